@@ -15,14 +15,38 @@ output by running:
 python3 ENA_data_helper.py download --help
 
 """
+import numpy as np
 import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import argparse
 import csv
 import time
+import os
+import gzip
+import hashlib
+import threading
 import pathlib
+import struct
+import zlib
 from io import StringIO
+import ftplib
+import urllib.parse
 import urllib.request
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# block size for streaming downloads to disk (1 MiB)
+DOWNLOAD_BUFFER_SIZE = 1 << 20
+
+# (connect, read) timeouts in seconds for HTTP(S) requests to ENA. Connecting fails fast, the read 
+# timeout leaves time for large searches, where ENA can take a while before the first byte
+HTTP_TIMEOUT = (5, 60)
+
+# ENA fields with only a handful of distinct values, stored as categorical columns to save memory
+ENA_CATEGORICAL_FIELDS = ['center_name', 'library_strategy']
 
 def args_parser():     
     parser = argparse.ArgumentParser(
@@ -75,11 +99,55 @@ def args_parser():
         type = int,
         help='Optional number of attempts to try FTP downloads. Defaults to 3')
 
+    download_parser.add_argument(
+        '--jobs','-j',
+        action = 'store',
+        default= 8,
+        required = False, 
+        type = int,
+        help='Optional number of FASTQ files to download concurrently. Defaults to 8')
+
+    download_parser.add_argument(
+        '--protocol',
+        action = 'store',
+        default= 'ftp',
+        required = False, 
+        choices = ['ftp', 'https'],
+        help='Optional protocol for downloads. With "https", the FTP URLs are downloaded from the same ENA server over HTTPS, using several concurrent range requests per file. Defaults to "ftp"')
+
+    download_parser.add_argument(
+        '--https_parts',
+        action = 'store',
+        default= 4,
+        required = False, 
+        type = int,
+        help='Optional number of concurrent range requests per file when using "--protocol https". Defaults to 4')
+
+    download_parser.add_argument(
+        '--bgzf',
+        action = 'store_true',
+        help ='when used, the downloaded gzip FASTQ files are recompressed to BGZF format on the fly, as required for indexing with htslib-based tools (samtools, bcftools, tabix)'
+    )
+
+    download_parser.add_argument(
+        '--verify_existing',
+        action = 'store_true',
+        help ='when used, FASTQ files that already exist in the output directory (e.g. from an earlier, interrupted run) are checked against the size of the remote file and downloaded again if the size differs. By default, existing files are kept without checking'
+    )
+
     download_parser.add_argument(
         '--no_manifest',
         action = 'store_true',
         help ='do not create a manifest file in the output directory'
     )
+
+    download_parser.add_argument(
+        '--manifest_format',
+        action = 'store',
+        default= 'csv',
+        required = False, 
+        choices = ['csv', 'parquet'],
+        help='Optional file format of the manifest file. "parquet" requires the pyarrow package. Defaults to "csv"')
     
     download_parser.add_argument(
         '--ftp_url_read_1_col',
@@ -109,7 +177,7 @@ def args_parser():
     return parser
 
 
-def create_ena_data_frame(df:pd.DataFrame, sample_id_col_name:str='sample', chunk_size:int=50):
+def create_ena_data_frame(df:pd.DataFrame, sample_id_col_name:str='sample', chunk_size:int=2000, max_workers:int=8, cache_dir:str=None):
     """
     Takes a DataFrame with a sample ID column (default name 'sample') and searches 
     ENA by sample ID ('sample_title' field in ENA). Returns a new dataframe with sample ID 
@@ -119,11 +187,14 @@ def create_ena_data_frame(df:pd.DataFrame, sample_id_col_name:str='sample', chun
     Args:
         df (pandas.DataFrame): A pandas DataFrame. Only needs a single column for sample IDs.  
             By default, this is expected to eb called 'sample' but can be changed. Other data  
-            is ignored.  
+            is ignored. Sample IDs don't need to be unique, each ID is searched once.  
         sample_id_col_name (str): Name of the sample ID column, defaults to 'sample'
         chunk_size (int): number of samples queried in one request. If the total number of 
             samples IDs is larger than this, the ENA query will be run in chunks.  
-            Defaults to 50.  
+            Defaults to 2000.  
+        max_workers (int): maximum number of chunks queried concurrently, defaults to 8
+        cache_dir (str): optional directory for caching ENA search responses, see _search_ena. 
+            Useful when the same data is searched repeatedly, e.g. when re-running a notebook.  
 
     Returns:
         pandas.DataFrame: A new DataFrame that contains the input sample IDs as well as the  
@@ -132,7 +203,8 @@ def create_ena_data_frame(df:pd.DataFrame, sample_id_col_name:str='sample', chun
 
     """
     try:
-        sample_ids=df[sample_id_col_name].tolist()
+        # duplicate sample IDs (e.g. from merged datasets) are only queried once, keeping the order
+        sample_ids=list(dict.fromkeys(df[sample_id_col_name].tolist()))
     except KeyError:
         raise ValueError(
             f'DataFrame is missing sample ID column, expected name {sample_id_col_name} ' +
@@ -140,35 +212,89 @@ def create_ena_data_frame(df:pd.DataFrame, sample_id_col_name:str='sample', chun
     
     fields = ['sample_title','run_accession','center_name','library_strategy','sample_accession','fastq_ftp','submitted_ftp']
     
-    # split the list of sample IDs into chunks of max_chunk_size IDs each in order 
-    # to avoid an exception due to URLs becoming too long
+    # split the list of sample IDs into chunks of chunk_size IDs each in order 
+    # to keep the size of a single query within the limits of the ENA API
     sample_id_chunks = [sample_ids[i:i + chunk_size] for i in range(0, len(sample_ids), chunk_size)]
     
-    ena_dfs=[]
-    for sample_ids_chunk in sample_id_chunks:
-        ena_response = _search_ena(samples=sample_ids_chunk, return_fields=fields)
-        ena_dfs.append(_parse_ena_response(ena_response))
-    ena_data = pd.concat(ena_dfs)
+    # the chunks are queried concurrently over the shared module session, so that connections to 
+    # ENA are reused between requests instead of opening a new TLS connection per chunk
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(_search_ena_rows, samples=sample_ids_chunk, return_fields=fields, cache_dir=cache_dir) 
+            for sample_ids_chunk in sample_id_chunks]
+        # rows of all chunks are collected first and turned into a single DataFrame at the end, 
+        # rather than creating one DataFrame per chunk and copying them all again to concatenate
+        header = fields
+        ena_rows = []
+        for future in futures:
+            chunk_header, rows = future.result()
+            if chunk_header:
+                header = chunk_header
+            ena_rows.extend(rows)
+    ena_data = _ena_rows_to_data_frame(header, ena_rows)
     
     # rename the sample_title column to match the original column name for the sample ID field
     ena_data.rename(columns={'sample_title': sample_id_col_name}, inplace=True)
     return ena_data
 
-def _search_ena(samples:list, return_fields:list, limit:int=10000):
+def _create_ena_session(pool_size:int=32):
+    """
+    Create a requests.Session for ENA API queries and HTTPS downloads, with a connection pool 
+    large enough for pool_size concurrent requests per host. Connection errors and transient 
+    server errors (429 and 5xx) are retried with exponential backoff, honouring Retry-After.  
+
+    Args:
+        pool_size (int): maximum number of connections kept open per host, defaults to 32
+
+    Returns:
+        requests.Session
+    """
+    retry = Retry(
+        total=5, 
+        backoff_factor=0.5, 
+        status_forcelist=[429, 500, 502, 503, 504],
+        # searches are sent as POST but are read-only, so they are safe to retry
+        allowed_methods=['HEAD', 'GET', 'POST'],
+        # return the last response instead of raising, raise_for_status() reports it
+        raise_on_status=False
+    )
+    session = requests.Session()
+    session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=retry))
+    return session
+
+# Session shared by all HTTP(S) traffic to ENA (search API and HTTPS downloads), so that open 
+# connections are reused across requests and across function calls, e.g. repeated searches in 
+# a notebook. requests sessions can be used from several threads for plain requests like these.
+_SESSION = _create_ena_session()
+
+def _search_ena(samples:list, return_fields:list, limit:int=0, session:requests.Session=None, cache_dir:str=None):
     """
     Run a search with the ENA API, querying by sample ID and return the search results response  
-    in raw text form. 
+    in raw text form. The query is sent as a POST request, so that long lists of sample IDs 
+    are not limited by the maximum URL length. Should the server still reject the request as 
+    too large (HTTP 413), the samples are split in two halves that are queried separately.  
     For details, consult the ENA API v2 documentation at 
     https://docs.google.com/document/d/1CwoY84MuZ3SdKYocqssumghBF88PWxUZ
 
     Args:
         samples (list): a list of sample IDs to search with
         return_fields (list): a list of the field names to return from ENA
-        limit (int): limit on number of results to return, defaults to 10000
+        limit (int): limit on number of results to return, defaults to 0 (all results)
+        session (requests.Session): optional session to send the request with, defaults to the 
+            shared module session
+        cache_dir (str): optional directory for caching responses. If given, a response that is 
+            already cached for the same samples, fields and limit is returned without querying 
+            ENA, and new responses are added to the cache.  
         
     Returns:
         Raw text response from ENA
     """
+    if cache_dir:
+        cache_path = _ena_search_cache_path(cache_dir, samples, return_fields, limit)
+        if cache_path.exists():
+            with gzip.open(cache_path, 'rt', encoding='utf-8') as fh:
+                return fh.read()
+
     ENA_SEARCH_BASE_URL='https://www.ebi.ac.uk/ena/portal/api/search'
     search_params = {
         'result': 'read_run',
@@ -176,13 +302,62 @@ def _search_ena(samples:list, return_fields:list, limit:int=10000):
         'fields': ','.join(return_fields),
         'limit': limit
     }
-    request = requests.get(ENA_SEARCH_BASE_URL, params=search_params, timeout=15)
-    request.raise_for_status() # throws exception if bad status returned
-    return request.text
+    http = session if session else _SESSION
+    request = http.post(ENA_SEARCH_BASE_URL, data=search_params, timeout=HTTP_TIMEOUT)
+    if request.status_code == 413 and len(samples) > 1:
+        half = len(samples) // 2
+        response_text = _search_ena(samples[:half], return_fields, limit=limit, session=session)
+        second_half = _search_ena(samples[half:], return_fields, limit=limit, session=session)
+        # both responses start with the same header line, keep only one of them. A half without 
+        # any results can come back with an empty body, so take the header from either half.  
+        halves = [text.partition('\n') for text in (response_text, second_half)]
+        header = next((header for header, _, _ in halves if header), '')
+        rows = ''.join(body.rstrip('\n') + '\n' for _, _, body in halves if body.strip())
+        response_text = f'{header}\n{rows}' if header else ''
+    else:
+        request.raise_for_status() # throws exception if bad status returned
+        # ENA responds with UTF-8, decode directly instead of letting requests guess the encoding
+        response_text = request.content.decode('utf-8')
+    
+    if cache_dir:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        with _atomic_write(cache_path) as tmp_path, gzip.open(tmp_path, 'wt', encoding='utf-8') as fh:
+            fh.write(response_text)
+    return response_text
+
+def _ena_search_cache_path(cache_dir:str, samples:list, return_fields:list, limit:int):
+    """
+    Path of the cache file for an ENA search. The file name is a hash of the search parameters, 
+    so it does not depend on the order of the sample IDs.  
+
+    Args:
+        cache_dir (str): path to the cache directory
+        samples (list): a list of sample IDs to search with
+        return_fields (list): a list of the field names to return from ENA
+        limit (int): limit on number of results to return
+
+    Returns:
+        PosixPath of the cache file
+    """
+    key = '|'.join(sorted(samples)) + '|' + ','.join(return_fields) + '|' + str(limit)
+    return pathlib.Path(cache_dir) / (hashlib.sha1(key.encode('utf-8')).hexdigest() + '.tsv.gz')
+
+def _search_ena_rows(samples:list, return_fields:list, cache_dir:str=None):
+    """
+    Run _search_ena and parse the response with _parse_ena_response_rows. Used by 
+    create_ena_data_frame to parse every chunk in its worker thread, so that the raw response 
+    text of a chunk is released as soon as it is parsed instead of being kept until all chunks 
+    are done.  
+
+    Returns:
+        tuple of the header (list of ENA field names) and the rows (list of tuples)
+    """
+    return _parse_ena_response_rows(_search_ena(samples=samples, return_fields=return_fields, cache_dir=cache_dir))
 
 def _parse_ena_response(response_text:str):
     """
-    Parse the response from a ENA search query into a pandas.DataFrame
+    Parse the response from a ENA search query into a pandas.DataFrame. Fields with few distinct 
+    values (see ENA_CATEGORICAL_FIELDS) are parsed as categorical columns.  
 
     Args:
         response_text (str): response text from ENA API query
@@ -190,7 +365,38 @@ def _parse_ena_response(response_text:str):
     Returns:
         pandas.DataFrame, see _search_ena for column names (ENA fieldnames)
     """
-    return pd.read_csv(StringIO(response_text), sep="\t")
+    return _ena_rows_to_data_frame(*_parse_ena_response_rows(response_text))
+
+def _parse_ena_response_rows(response_text:str):
+    """
+    Parse the response from a ENA search query into plain rows of values. All values are strings, 
+    empty values are returned as None.  
+
+    Args:
+        response_text (str): response text from ENA API query
+        
+    Returns:
+        tuple of the header (list of ENA field names) and the rows (list of tuples)
+    """
+    reader = csv.reader(StringIO(response_text), delimiter='\t', quoting=csv.QUOTE_NONE)
+    header = next(reader, [])
+    rows = [tuple(value if value else None for value in row) for row in reader if row]
+    return header, rows
+
+def _ena_rows_to_data_frame(header:list, rows:list):
+    """
+    Create a pandas.DataFrame from rows parsed by _parse_ena_response_rows. Fields with few 
+    distinct values (see ENA_CATEGORICAL_FIELDS) are stored as categorical columns.  
+
+    Args:
+        header (list): ENA field names
+        rows (list): list of tuples of values, in the order of the header
+
+    Returns:
+        pandas.DataFrame
+    """
+    ena_data = pd.DataFrame.from_records(rows, columns=header)
+    return ena_data.astype({field: 'category' for field in ENA_CATEGORICAL_FIELDS if field in ena_data})
     
 def _build_ena_query(samples:list):
     """
@@ -221,10 +427,10 @@ def merge_ena_results_into_sample_data_genre_pf8(sample_data:pd.DataFrame, ena_r
     In this case, we expect every sample to have one "run accession" for each of the three 
     AmpSeq panels (GRC1, GRC2, SPEC) in GenRe plus one for Pf8 WGS.
     We create 4 new columns accordingly:  
-        - ENA_acc_GenRe_GRC1
-        - ENA_acc_GenRe_GRC2
-        - ENA_acc_GenRe_SPEC
-        - ENA_acc_Pf8
+        - INSDC_GenRe_GRC1
+        - INSDC_GenRe_GRC2
+        - INSDC_GenRe_SPEC
+        - INSDC_Pf8
         
     If include_download_link is used (default), the following 8 additional columns are added, 
     which contain the FTP download links for the FASTQ files (mate 1 and 2) corresponding to the ENA 
@@ -259,87 +465,89 @@ def merge_ena_results_into_sample_data_genre_pf8(sample_data:pd.DataFrame, ena_r
     if not sample_id_col_name in sample_data or not sample_id_col_name in ena_result:
         raise ValueError('both DataFrames need to have a column "sample"')
     
-    new_df = sample_data.copy().set_index('sample')
-    new_df['INSDC_Pf8'] = None
-    new_df['INSDC_GenRe_GRC1'] = None
-    new_df['INSDC_GenRe_GRC2'] = None
-    new_df['INSDC_GenRe_SPEC'] = None
-
+    required_cols = [sample_id_col_name, 'run_accession', 'center_name', 'library_strategy', 'submitted_ftp']
     if include_download_link:
-        for i in [1,2]:
-            new_df['GenRe_GRC1_ENA_FASTQ_FTP_'+str(i)] = None
-            new_df['GenRe_GRC2_ENA_FASTQ_FTP_'+str(i)] = None
-            new_df['GenRe_SPEC_ENA_FASTQ_FTP_'+str(i)] = None
-            new_df['Pf8_ENA_FASTQ_FTP_'+str(i)] = None
+        required_cols.append('fastq_ftp')
+    try:
+        ena = ena_result[required_cols].copy()
+    except KeyError as e:
+        raise ValueError(f'ENA result DataFrame is missing required column: {e}')
+    # center and strategy repeat across all rows. As categoricals, the string checks below are 
+    # evaluated once per distinct value rather than once per row (no-op if already categorical)
+    ena = ena.astype({field: 'category' for field in ENA_CATEGORICAL_FIELDS})
 
-    for _,row in ena_result.iterrows():
-        try:
-            sample = row[sample_id_col_name]
-            run_accession = row['run_accession']
-            center = row['center_name']
-            strategy = row['library_strategy']
-            submitted_ftp = row['submitted_ftp']
-            if include_download_link:
-                fastq_ftp = row['fastq_ftp']
-        except KeyError as e:
-            raise ValueError(f'ENA result DataFrame is missing required column: {e}')
-        
-        run_accession_type = None
-        if 'Wellcome Sanger' in center:
-            if strategy!='WGS':
-                msg=f'This row of ENA search results is expected to contain a Pf8 WGS sample but the library strategy is not "WGS": {row}'
-                if skip_errors:
-                    print(msg + ' - skip_errors active, skipping this row')
-                else:
-                    raise ValueError(msg)
-            run_accession_type='Pf8'
-            
-        elif 'GenRe-Mekong' in center:
-            if strategy!='AMPLICON':
-                msg=f'This row of ENA search results is expected to contain a GenRe AMPLICON sample but the library strategy is not "AMPLICON": {row}'
-                if skip_errors:
-                    print(msg + ' - skip_errors active, skipping this row')
-                else:
-                    raise ValueError(msg)
-            if 'GRC1' in submitted_ftp:
-                run_accession_type='GenRe_GRC1'
-            elif 'GRC2' in submitted_ftp:
-                run_accession_type='GenRe_GRC2'
-            elif 'SPEC' in submitted_ftp:
-                run_accession_type= 'GenRe_SPEC'
-            else:
-                msg=f'could not extract primer panel from GenRe data row: {row}'
-                if skip_errors:
-                    print(msg + ' - skip_errors active, skipping this row')
-                else:
-                    raise ValueError(msg)
-                
-        if not run_accession_type:
-            msg=f'could not assign ENA result to Pf8 or GenRe {row}'
+    # classify all rows at once: Pf8 or GenRe, and the GenRe panel from the submitted file names
+    center = ena['center_name']
+    submitted_ftp = ena['submitted_ftp']
+    # plain substring matches (regex=False), no regular expression engine needed
+    is_pf8 = center.str.contains('Wellcome Sanger', regex=False, na=False)
+    is_genre = ~is_pf8 & center.str.contains('GenRe-Mekong', regex=False, na=False)
+    is_grc1 = submitted_ftp.str.contains('GRC1', regex=False, na=False)
+    is_grc2 = submitted_ftp.str.contains('GRC2', regex=False, na=False)
+    is_spec = submitted_ftp.str.contains('SPEC', regex=False, na=False)
+    ena['run_accession_type'] = np.select(
+        [is_pf8, is_genre & is_grc1, is_genre & is_grc2, is_genre & is_spec],
+        ['Pf8', 'GenRe_GRC1', 'GenRe_GRC2', 'GenRe_SPEC'], 
+        default=None)
+
+    # sanity checks, only the (rare) failing rows are reported one by one
+    sanity_checks = [
+        (is_pf8 & (ena['library_strategy'] != 'WGS'), 
+            'This row of ENA search results is expected to contain a Pf8 WGS sample but the library strategy is not "WGS"'),
+        (is_genre & (ena['library_strategy'] != 'AMPLICON'), 
+            'This row of ENA search results is expected to contain a GenRe AMPLICON sample but the library strategy is not "AMPLICON"'),
+        (is_genre & ena['run_accession_type'].isna(), 
+            'could not extract primer panel from GenRe data row'),
+        (~is_pf8 & ~is_genre, 
+            'could not assign ENA result to Pf8 or GenRe'),
+    ]
+    failed_rows = pd.Series(False, index=ena.index)
+    for failed, msg in sanity_checks:
+        for _, row in ena[failed & ~failed_rows].iterrows():
             if skip_errors:
-                print(msg + ' - skip_errors active, skipping this row')
+                print(f'{msg}: {row} - skip_errors active, skipping this row')
             else:
-                raise ValueError(msg)
-        
-        accession_col = 'INSDC_'+run_accession_type
-        if new_df.loc[[sample], accession_col].any():
-            raise ValueError(f'More than one run accessions found for sample {sample}, field {accession_col}')
-        else:
-            new_df.loc[sample, accession_col]=run_accession
-            if include_download_link:
-                if not ';' in fastq_ftp:
-                    raise ValueError(f'FASTQ FTP field in this row does not contain 2 links: {row}')
-                for i, ftp_url in enumerate(fastq_ftp.split(';')):
-                    ftp_url.strip()
-                    if not ftp_url.startswith('ftp://'):
-                        ftp_url = 'ftp://'+ftp_url
-                    ftp_col = run_accession_type+'_ENA_FASTQ_FTP_'+str(i+1)
-                    new_df.loc[sample, ftp_col]=ftp_url
+                raise ValueError(f'{msg}: {row}')
+        failed_rows |= failed
+    ena = ena[~failed_rows]
+
+    duplicated = ena.duplicated(subset=[sample_id_col_name, 'run_accession_type'])
+    if duplicated.any():
+        row = ena[duplicated].iloc[0]
+        raise ValueError(f'More than one run accessions found for sample {row[sample_id_col_name]}, field INSDC_{row["run_accession_type"]}')
+
+    value_cols = ['run_accession']
+    if include_download_link:
+        # exactly two links (read 1 and read 2) separated by ';' are expected
+        not_two_mates = ena['fastq_ftp'].str.count(';').ne(1)
+        if not_two_mates.any():
+            raise ValueError(f'FASTQ FTP field in this row does not contain 2 links: {ena[not_two_mates].iloc[0]}')
+        # reindex keeps both columns if there are no rows left (empty result or all rows skipped)
+        ftp_urls = ena['fastq_ftp'].str.split(';', n=1, expand=True).reindex(columns=[0, 1], fill_value='')
+        for i in [1,2]:
+            ftp_url = ftp_urls[i-1].str.strip()
+            ena[f'ftp_url_{i}'] = ftp_url.where(ftp_url.str.startswith('ftp://'), 'ftp://' + ftp_url)
+            value_cols.append(f'ftp_url_{i}')
+
+    # one row per sample, one column per (value, run accession type)
+    run_accession_types = ['Pf8', 'GenRe_GRC1', 'GenRe_GRC2', 'GenRe_SPEC']
+    new_cols = {('run_accession', t): 'INSDC_' + t for t in run_accession_types}
+    if include_download_link:
+        for i in [1,2]:
+            for t in ['GenRe_GRC1', 'GenRe_GRC2', 'GenRe_SPEC', 'Pf8']:
+                new_cols[(f'ftp_url_{i}', t)] = t + '_ENA_FASTQ_FTP_' + str(i)
+    wide = ena.pivot(index=sample_id_col_name, columns='run_accession_type', values=value_cols)
+    wide = wide.reindex(columns=pd.MultiIndex.from_tuples(new_cols.keys()))
+    wide.columns = list(new_cols.values())
+
+    new_df = sample_data.copy().set_index(sample_id_col_name)
+    wide = wide.reindex(new_df.index).astype(object)
+    new_df[wide.columns] = wide.where(wide.notna(), None)
 
     return new_df
 
 
-def download_all_fastqs(outdir, data:pd.DataFrame=None, data_file_path:str=None, create_manifest:bool=True, num_tries:int=3, ftp_url_read_1_col:str='ftp_url_read_1',ftp_url_read_2_col:str='ftp_url_read_2',run_accession_col:str='run_accession',skip_errors:bool=False,top3:bool=False):
+def download_all_fastqs(outdir, data:pd.DataFrame=None, data_file_path:str=None, create_manifest:bool=True, num_tries:int=3, ftp_url_read_1_col:str='ftp_url_read_1',ftp_url_read_2_col:str='ftp_url_read_2',run_accession_col:str='run_accession',skip_errors:bool=False,top3:bool=False,jobs:int=8,manifest_format:str='csv',protocol:str='ftp',https_parts:int=4,bgzf:bool=False,verify_existing:bool=False):
     """
     Download the FASTQ files from a table of FTP URLs, which can be provided as a DataFrame or a path to a 
     csv file. The file must contains a column for the ENA run accession and one column each for the FASTQ 
@@ -363,92 +571,184 @@ def download_all_fastqs(outdir, data:pd.DataFrame=None, data_file_path:str=None,
         create_manifest (bool): if True, a manifest file is created in {outdir}
         skip_errors (bool): if True, skip download errors and continue with next time, don't throw exception. 
         top3 (bool): if True, only process the first 3 rows of the data (useful for testing)
+        jobs (int): maximum number of FASTQ files downloaded concurrently, defaults to 8
+        manifest_format (str): file format of the manifest, 'csv' (default, manifest.csv) or 
+            'parquet' (manifest.parquet, requires pyarrow)
+        protocol (str): 'ftp' (default) or 'https'. With 'https', files are downloaded from the 
+            same server over HTTPS, split into https_parts concurrent range requests per file
+        https_parts (int): number of concurrent range requests per file for protocol 'https', 
+            defaults to 4
+        bgzf (bool): if True, the gzipped FASTQ files are recompressed to BGZF format while they 
+            are downloaded, so they can be indexed by htslib-based tools. Files are downloaded 
+            in a single transfer each in this mode (https_parts is not used).  
+        verify_existing (bool): FASTQ files that already exist in outdir (e.g. from an earlier, 
+            interrupted run) are not downloaded again. If True, their size is first compared to 
+            the size of the remote file and files that don't match are downloaded again.  
+            Not used with bgzf, where local and remote sizes differ.  
         
     Returns:
         True on success
         
-        If option create_manifest in use, creates a CSV file in outdir with the following fields:
+        If option create_manifest in use, creates a CSV (or Parquet) file in outdir with the following fields:
         'run_accession','ftp_url_read_1','ftp_url_read_2','read_1_file','read_2_file'
 
     """
     if not isinstance(data, pd.DataFrame) and not data_file_path:
         raise ValueError('must provide either "data" or "data_file_path" parameter')
+    if protocol not in ('ftp', 'https'):
+        raise ValueError(f'unsupported protocol "{protocol}", must be "ftp" or "https"')
+    if manifest_format not in ('csv', 'parquet'):
+        raise ValueError(f'unsupported manifest format "{manifest_format}", must be "csv" or "parquet"')
+    if create_manifest and manifest_format == 'parquet':
+        # fail before any downloads are started if the manifest can't be written at the end
+        try:
+            import pyarrow
+        except ImportError:
+            raise ImportError('manifest format "parquet" requires the pyarrow package')
     if isinstance(data, pd.DataFrame) and data_file_path:
         raise ValueError('must provide either "data" or "data_file_path" parameter, not both')
+    required_cols = [run_accession_col, ftp_url_read_1_col, ftp_url_read_2_col]
     if data_file_path:
-        data = pd.read_csv(data_file_path)
+        # only parse the columns that are used, sample sheets often have many more. Missing 
+        # columns are not an error here, so that they are reported by the check below
+        data = pd.read_csv(data_file_path, usecols=lambda col: col in required_cols)
     
     outdir = pathlib.Path(outdir)
     outdir.mkdir(parents=True, exist_ok=True)
     
-    if create_manifest:
-        manifest_path = outdir / 'manifest.csv'
-        fields = 'run_accession','ftp_url_read_1','ftp_url_read_2','read_1_file','read_2_file'
-        manifest_fh = open(manifest_path, 'w', newline='')
-        manifest_writer = csv.DictWriter(manifest_fh, fieldnames=fields)
-        manifest_writer.writeheader()
-    
-    n_rows = len(data)
-    i = 0
-    for _, row in data.iterrows():
-        i+=1
-        if top3 and i>3:
-            print("option top3 in use: stopping after three rows processed")
-            break
+    if top3 and len(data)>3:
+        print("option top3 in use: stopping after three rows processed")
+        data = data.head(3)
+
+    if any(col not in data for col in required_cols):
+        raise ValueError(f'data is missing columns. Make sure the following columns exist: {", ".join(required_cols)}')
+    rows = list(zip(data[run_accession_col], data[ftp_url_read_1_col], data[ftp_url_read_2_col]))
+
+    # Every local file is downloaded only once, even if several rows refer to it (e.g. duplicate 
+    # rows), so that concurrent downloads never write to the same file. 
+    # local path -> (URL, list of (row, mate) using the file)
+    downloads = {}
+    for i, (_, ftp_url_read_1, ftp_url_read_2) in enumerate(rows):
+        for mate, ftp_url in enumerate([ftp_url_read_1, ftp_url_read_2]):
+            local_path = _resolve_download(ftp_url, outdir, protocol=protocol)[1]
+            downloads.setdefault(local_path, (ftp_url, []))[1].append((i, mate))
+
+    # pre-flight check, only needs a stat call per file
+    n_existing = sum(local_path.exists() for local_path in downloads)
+    if n_existing:
+        action = 'checking their size against the remote files' if verify_existing and not bgzf else 'not downloading them again'
+        print(f'{n_existing} of {len(downloads)} FASTQ files already exist in {outdir}, {action}')
+
+    # Downloads are network-bound and independent of each other, so they are run concurrently. 
+    # Results are collected per row so that the manifest keeps the order of the input data.
+    n_rows = len(rows)
+    local_files = [[None, None] for _ in rows]
+    pending_files = [2] * n_rows
+    n_pairs_done = 0
+    # FTP control connections and HTTPS connections are shared between consecutive downloads 
+    # from the same host
+    abort = threading.Event()
+    # not used as a context manager, which would wait for all running downloads on errors
+    executor = ThreadPoolExecutor(max_workers=jobs)
+    with _FTPConnectionPool() as ftp_pool:
         try:
-            run_accession = row[run_accession_col]
-            ftp_url_read_1 = row[ftp_url_read_1_col]
-            ftp_url_read_2 = row[ftp_url_read_2_col]
-        except KeyError:
-            raise ValueError(f'data is missing columns. Make sure the following columns exist: {", ".join([run_accession_col, ftp_url_read_1_col, ftp_url_read_2_col])}')
-        read_1_file = _download_fastq_file( ftp_url_read_1, outdir, num_tries=num_tries, skip_errors=skip_errors)
-        read_2_file = _download_fastq_file( ftp_url_read_2, outdir, num_tries=num_tries, skip_errors=skip_errors)
-        print(f'downloaded FASTQ pair {i} of {n_rows}')
-            
-        if create_manifest:
-            manifest_writer.writerow({
-                'run_accession': run_accession,
-                'ftp_url_read_1': ftp_url_read_1,
-                'ftp_url_read_2': ftp_url_read_2,
-                'read_1_file': read_1_file,
-                'read_2_file': read_2_file
-            })
-        
+            futures = {}
+            for ftp_url, users in downloads.values():
+                future = executor.submit(
+                    _download_fastq_file, ftp_url, outdir, num_tries=num_tries, skip_errors=skip_errors, 
+                    ftp_pool=ftp_pool, protocol=protocol, https_parts=https_parts, bgzf=bgzf, 
+                    verify_existing=verify_existing, abort=abort)
+                futures[future] = users
+            for future in as_completed(futures):
+                local_file = future.result()
+                for i, mate in futures[future]:
+                    local_files[i][mate] = local_file
+                    pending_files[i] -= 1
+                    if not pending_files[i]:
+                        n_pairs_done += 1
+                        print(f'downloaded FASTQ pair {n_pairs_done} of {n_rows}')
+        except BaseException:
+            # stop the running downloads after a failure or Ctrl-C
+            abort.set()
+            raise
+        finally:
+            # queued downloads are not started, running ones are not waited for
+            executor.shutdown(wait=False, cancel_futures=True)
+
     if create_manifest:
-        manifest_fh.close()
+        fields = ['run_accession','ftp_url_read_1','ftp_url_read_2','read_1_file','read_2_file']
+        manifest = pd.DataFrame(
+            [(*row, *files) for row, files in zip(rows, local_files)], columns=fields)
+        with _atomic_write(outdir / f'manifest.{manifest_format}') as tmp_path:
+            if manifest_format == 'parquet':
+                # columns with repeated values are dictionary-encoded by pyarrow
+                manifest.to_parquet(tmp_path, index=False, compression='zstd')
+            else:
+                # same line endings as the csv module default, which earlier versions wrote the manifest with
+                manifest.to_csv(tmp_path, index=False, lineterminator='\r\n')
     
     return True
 
-def _download_fastq_file( remote_ftp_url:str, dir, num_tries:int=3, skip_errors:bool=False):
+def _download_fastq_file( remote_ftp_url:str, dir, num_tries:int=3, skip_errors:bool=False, ftp_pool=None, protocol:str='ftp', session:requests.Session=None, https_parts:int=4, bgzf:bool=False, verify_existing:bool=False, abort:threading.Event=None):
     """
-    Downloads a single FASTQ file from a remote URL path into a local file
+    Downloads a single FASTQ file from a remote URL path into a local file. Failed attempts are 
+    retried after a delay that doubles with every attempt (5s, 10s, 20s, ... up to 60s). Where 
+    possible, a retry resumes the transfer where the failed attempt stopped, see _fetch_url_to_file.  
 
     Args:
         remote_ftp_url (str): URL of the remote file
         dir (PosixPath): path to directory into which the file is downloaded
         num_tries (int): number of times download should be tried in case of errors
         skip_errors (bool): if True, skip download errors and continue with next time, don't throw exception. 
+        ftp_pool (_FTPConnectionPool): optional pool of open FTP connections to download with, 
+            see _fetch_url_to_file
+        protocol (str): 'ftp' (default) or 'https' to download the file from the same server over HTTPS
+        session (requests.Session): optional session for HTTPS downloads, defaults to the shared module session
+        https_parts (int): number of concurrent range requests for HTTPS downloads, defaults to 4
+        bgzf (bool): if True, the file is recompressed to BGZF format while downloading
+        verify_existing (bool): if True and the local file exists already, its size is compared to 
+            the size of the remote file and it is downloaded again if the sizes differ. If False 
+            (default), an existing file is returned without checking. Not used with bgzf.  
+        abort (threading.Event): optional event that stops the download when set, by raising 
+            _DownloadAborted. The download is not retried then, also with skip_errors.  
 
     Returns:
         PosixPath of locally downloaded file
     """
-    if not remote_ftp_url.startswith('ftp://'):
-        remote_ftp_url = 'ftp://'+remote_ftp_url
-    
-    file_name = remote_ftp_url.split('/')[-1]
-    local_path = pathlib.Path(dir) / file_name
-    local_path = local_path.resolve()
+    remote_ftp_url, local_path = _resolve_download(remote_ftp_url, dir, protocol=protocol)
     
     attempt = 1
     last_error = None
-    while not local_path.exists() and attempt <= num_tries:
-        try:
-            urllib.request.urlretrieve(remote_ftp_url, local_path)
-        except Exception as e:
-            print(f'download attempt {attempt} of {num_tries} failed for URL {remote_ftp_url}')
-            last_error = e
-            attempt += 1
-            time.sleep(5)
+    # FTP downloads always go through a connection pool, which supports resuming transfers. 
+    # A pool created here for a single file is closed again at the end.
+    with (nullcontext(ftp_pool) if ftp_pool else _FTPConnectionPool()) as ftp_pool:
+        if verify_existing and not bgzf and local_path.exists():
+            try:
+                remote_size = _remote_size(remote_ftp_url, ftp_pool=ftp_pool, session=session)
+            except Exception as e:
+                print(f'could not check the size of {remote_ftp_url}, keeping existing file {local_path}: {e}')
+                remote_size = None
+            if remote_size is not None and local_path.stat().st_size != remote_size:
+                print(f'existing file {local_path} does not match the size of the remote file, downloading it again')
+                local_path.unlink()
+        
+        while not local_path.exists() and attempt <= num_tries:
+            try:
+                _check_abort(abort)
+                _fetch_url_to_file(remote_ftp_url, local_path, ftp_pool=ftp_pool, session=session, https_parts=https_parts, bgzf=bgzf, abort=abort)
+            except _DownloadAborted:
+                raise
+            except Exception as e:
+                print(f'download attempt {attempt} of {num_tries} failed for URL {remote_ftp_url}')
+                last_error = e
+                if attempt < num_tries:
+                    delay = min(5 * 2 ** (attempt - 1), 60)
+                    # an abort ends the wait early and is raised by the next attempt
+                    if abort:
+                        abort.wait(delay)
+                    else:
+                        time.sleep(delay)
+                attempt += 1
             
     if not local_path.exists():
         msg = f'Failed to download {remote_ftp_url} after {attempt} attempts. Last error raised: {last_error}'
@@ -464,6 +764,427 @@ def _download_fastq_file( remote_ftp_url:str, dir, num_tries:int=3, skip_errors:
     
     return str(local_path)
 
+class _DownloadAborted(Exception):
+    """
+    Raised in a download thread to stop its transfer, after another download has failed or the 
+    user has interrupted download_all_fastqs.  
+    """
+
+def _check_abort(abort:threading.Event):
+    """
+    Raise _DownloadAborted if the optional event abort is set
+    """
+    if abort and abort.is_set():
+        raise _DownloadAborted('download aborted')
+
+def _resolve_download(remote_ftp_url:str, dir, protocol:str='ftp'):
+    """
+    Normalise an ENA FTP URL (which may lack the 'ftp://' prefix) for download with the given 
+    protocol and determine the local path of the downloaded file.  
+
+    Args:
+        remote_ftp_url (str): FTP URL of the remote file
+        dir (PosixPath): path to directory into which the file is downloaded
+        protocol (str): 'ftp' (default) or 'https'
+
+    Returns:
+        tuple of the URL (str) and the local file path (PosixPath)
+    """
+    if not remote_ftp_url.startswith('ftp://'):
+        remote_ftp_url = 'ftp://'+remote_ftp_url
+    
+    if protocol == 'https':
+        # ENA serves the same files over HTTPS at the same location
+        remote_ftp_url = 'https://' + remote_ftp_url[len('ftp://'):]
+    
+    file_name = remote_ftp_url.split('/')[-1]
+    local_path = pathlib.Path(dir) / file_name
+    return remote_ftp_url, local_path.resolve()
+
+def _fetch_url_to_file(url:str, local_path:pathlib.Path, ftp_pool=None, session:requests.Session=None, https_parts:int=4, bgzf:bool=False, abort:threading.Event=None):
+    """
+    Stream a remote file into a local file. Data is copied in large blocks to keep the number of 
+    read/write calls per file low. The data is written to a temporary '.part' file first, which 
+    is only renamed to the final file name once the transfer is complete, so an interrupted 
+    transfer never leaves behind a file that looks like a finished download.  
+    If a '.part' file from an interrupted transfer exists, the download is resumed at its end 
+    (FTP REST or HTTP Range request), unless the size of the remote file is unknown or smaller 
+    than the partial file. Transfers split into concurrent HTTP range requests resume each range 
+    where it stopped, see _fetch_http_ranged. BGZF conversions always start from the beginning, 
+    they are written to a separate '.part.bgzf' file because their data differs from the remote 
+    file and must never be resumed by a plain transfer.  
+
+    Args:
+        url (str): URL of the remote file
+        local_path (PosixPath): path of the local file to create
+        ftp_pool (_FTPConnectionPool): if given, FTP URLs are retrieved over a connection from 
+            this pool instead of opening (and logging in to) a new connection for every file
+        session (requests.Session): optional session for HTTP(S) URLs, defaults to the shared module session
+        https_parts (int): number of concurrent range requests for HTTP(S) URLs, defaults to 4
+        bgzf (bool): if True, the remote gzip file is recompressed to BGZF while it is downloaded, 
+            see _GzipToBgzfWriter
+        abort (threading.Event): optional event that stops the transfer when set, see _stream_url
+    """
+    if bgzf:
+        # the gzip stream has to be decompressed in order, so it is downloaded sequentially
+        bgzf_part_path = local_path.with_name(local_path.name + '.part.bgzf')
+        with open(bgzf_part_path, 'wb') as fh, _GzipToBgzfWriter(fh) as bgzf_writer:
+            _stream_url(url, bgzf_writer.write, ftp_pool=ftp_pool, session=session, abort=abort)
+        bgzf_part_path.replace(local_path)
+        return
+    
+    part_path = local_path.with_name(local_path.name + '.part')
+    ranges_path = _ranges_path(part_path)
+    if ranges_path.exists() and not (urllib.parse.urlparse(url).scheme in ('http', 'https') and https_parts > 1):
+        # the partial file is from an interrupted range download and has gaps, it can only be 
+        # resumed by _fetch_http_ranged, a single transfer has to start from the beginning
+        part_path.unlink(missing_ok=True)
+        ranges_path.unlink()
+    if urllib.parse.urlparse(url).scheme in ('http', 'https') and https_parts > 1:
+        _fetch_http_ranged(url, part_path, session=session, n_parts=https_parts, abort=abort)
+    else:
+        offset = part_path.stat().st_size if part_path.exists() else 0
+        remote_size = _remote_size(url, ftp_pool=ftp_pool, session=session) if offset else None
+        if remote_size is None or offset > remote_size:
+            offset = 0
+        # offset == remote_size: all data was received before, only the rename is missing
+        if offset != remote_size:
+            with open(part_path, 'ab' if offset else 'wb') as fh:
+                _stream_url(url, fh.write, ftp_pool=ftp_pool, session=session, offset=offset, abort=abort)
+    part_path.replace(local_path)
+
+def _remote_size(url:str, ftp_pool=None, session:requests.Session=None):
+    """
+    Size of a remote file in bytes, from an FTP SIZE command or an HTTP HEAD request. 
+
+    Args:
+        url (str): URL of the remote file
+        ftp_pool (_FTPConnectionPool): optional pool of open FTP connections for FTP URLs
+        session (requests.Session): optional session for HTTP(S) URLs, defaults to the shared module session
+
+    Returns:
+        int size, or None if the size can't be determined for this URL
+    """
+    parsed_url = urllib.parse.urlparse(url)
+    if parsed_url.scheme in ('http', 'https'):
+        http = session if session else _SESSION
+        head = http.head(url, allow_redirects=True, timeout=HTTP_TIMEOUT)
+        head.raise_for_status()
+        size = head.headers.get('Content-Length')
+        return int(size) if size else None
+    elif ftp_pool and parsed_url.scheme == 'ftp':
+        with ftp_pool.connection(parsed_url.hostname) as ftp:
+            ftp.voidcmd('TYPE I') # SIZE is only reliable in binary mode
+            return ftp.size(urllib.parse.unquote(parsed_url.path))
+    return None
+
+def _stream_url(url:str, write, ftp_pool=None, session:requests.Session=None, offset:int=0, abort:threading.Event=None):
+    """
+    Download a remote file in a single sequential transfer, passing the data on to a write 
+    function in blocks of up to DOWNLOAD_BUFFER_SIZE bytes.  
+
+    Args:
+        url (str): URL of the remote file
+        write (function): called with every block of data received
+        ftp_pool (_FTPConnectionPool): optional pool of open FTP connections for FTP URLs
+        session (requests.Session): optional session for HTTP(S) URLs, defaults to the shared module session
+        offset (int): start the transfer at this byte position, defaults to 0. Only supported for 
+            FTP URLs with an ftp_pool and for HTTP(S) URLs.
+        abort (threading.Event): optional event that is checked before every block is written. 
+            If it is set, the transfer is stopped by raising _DownloadAborted.  
+    """
+    if abort:
+        unchecked_write = write
+        def write(block):
+            _check_abort(abort)
+            unchecked_write(block)
+    parsed_url = urllib.parse.urlparse(url)
+    if parsed_url.scheme in ('http', 'https'):
+        http = session if session else _SESSION
+        headers = {'Range': f'bytes={offset}-'} if offset else None
+        with http.get(url, headers=headers, stream=True, timeout=HTTP_TIMEOUT) as response:
+            response.raise_for_status()
+            # if the server ignores the range request, the first offset bytes are skipped
+            skip = offset if response.status_code != 206 else 0
+            for block in _response_blocks(response):
+                if skip:
+                    skipped = min(skip, len(block))
+                    block = block[skipped:]
+                    skip -= skipped
+                if block:
+                    write(block)
+    elif ftp_pool and parsed_url.scheme == 'ftp':
+        with ftp_pool.connection(parsed_url.hostname) as ftp:
+            ftp.retrbinary(
+                f'RETR {urllib.parse.unquote(parsed_url.path)}', write, blocksize=DOWNLOAD_BUFFER_SIZE, rest=offset or None)
+    elif offset:
+        raise ValueError(f'resuming a transfer is not supported for URL {url}')
+    else:
+        with urllib.request.urlopen(url) as response:
+            for block in iter(lambda: response.read(DOWNLOAD_BUFFER_SIZE), b''):
+                write(block)
+
+def _response_blocks(response:requests.Response):
+    """
+    Iterate over the body of a streamed HTTP response in blocks of up to DOWNLOAD_BUFFER_SIZE bytes. 
+    The blocks are read directly from the underlying urllib3 response, without the extra generator 
+    layer of response.iter_content. The data is passed on exactly as sent: FASTQ files are already 
+    gzip-compressed and must not be decoded, even if a server sets a Content-Encoding header.  
+
+    Args:
+        response (requests.Response): response of a request sent with stream=True
+
+    Returns:
+        iterator over blocks of bytes
+    """
+    return response.raw.stream(DOWNLOAD_BUFFER_SIZE, decode_content=False)
+
+def _fetch_http_ranged(url:str, local_path:pathlib.Path, session:requests.Session=None, n_parts:int=4, abort:threading.Event=None):
+    """
+    Download a file over HTTP(S) with n_parts concurrent byte-range requests. A single TCP stream 
+    is often limited by its window size or packet loss on long-distance links, several streams 
+    make better use of the available bandwidth. Each part is written at its offset into the local 
+    file. A single request is used if the server does not report the file size or does not 
+    support range requests.  
+    The progress of every range is kept in a '.ranges' file next to local_path while the 
+    transfer is running, so that an interrupted transfer can continue each range where it 
+    stopped instead of downloading the whole file again.  
+
+    Args:
+        url (str): HTTP(S) URL of the remote file
+        local_path (PosixPath): path of the local file to create
+        session (requests.Session): optional session to send the requests with, defaults to the shared module session
+        n_parts (int): number of concurrent range requests, defaults to 4
+        abort (threading.Event): optional event that stops the transfer when set, see _stream_url
+    """
+    http = session if session else _SESSION
+    head = http.head(url, allow_redirects=True, timeout=HTTP_TIMEOUT)
+    head.raise_for_status()
+    size = int(head.headers.get('Content-Length', 0))
+    
+    ranges_path = _ranges_path(local_path)
+    if n_parts < 2 or not size or head.headers.get('Accept-Ranges') != 'bytes':
+        ranges_path.unlink(missing_ok=True)
+        with open(local_path, 'wb') as fh:
+            _stream_url(url, fh.write, session=session, abort=abort)
+        return
+
+    ranges = _read_ranges(ranges_path, size) if local_path.exists() else None
+    resume = ranges is not None
+    if not resume:
+        part_size = -(-size // n_parts) # ceiling division
+        # each range is a list of [next byte to download, last byte], updated while downloading
+        ranges = [[start, min(start + part_size, size) - 1] for start in range(0, size, part_size)]
+        # written before any data, so a partial file always comes with its ranges file
+        _write_ranges(ranges_path, size, ranges)
+    
+    fd = os.open(local_path, os.O_WRONLY | os.O_CREAT | (0 if resume else os.O_TRUNC), 0o644)
+    try:
+        with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+            futures = [executor.submit(_fetch_http_range, http, url, fd, byte_range, abort) for byte_range in ranges]
+            for future in futures:
+                future.result()
+    finally:
+        os.close(fd)
+        if all(start > end for start, end in ranges):
+            ranges_path.unlink(missing_ok=True)
+        else:
+            _write_ranges(ranges_path, size, ranges)
+
+def _fetch_http_range(http, url:str, fd:int, byte_range:list, abort:threading.Event=None):
+    """
+    Download the bytes byte_range[0] to byte_range[1] (inclusive) of url and write them at the 
+    same offset into the open file descriptor fd. byte_range[0] is moved forward as data is 
+    written, so after an error it points to the first byte still missing. Stops if abort is set. 
+    Used by _fetch_http_ranged.  
+    """
+    start, end = byte_range
+    if start > end:
+        return
+    with http.get(url, headers={'Range': f'bytes={start}-{end}'}, stream=True, timeout=HTTP_TIMEOUT) as response:
+        response.raise_for_status()
+        if response.status_code != 206:
+            raise IOError(f'server did not return the requested byte range for {url}')
+        for block in _response_blocks(response):
+            _check_abort(abort)
+            os.pwrite(fd, block, byte_range[0])
+            byte_range[0] += len(block)
+    if byte_range[0] != end + 1:
+        raise IOError(f'incomplete download of bytes {start}-{end} for {url}')
+
+def _ranges_path(local_path:pathlib.Path):
+    """
+    Path of the file that records the progress of a range download into local_path.  
+    """
+    return local_path.with_name(local_path.name + '.ranges')
+
+def _write_ranges(ranges_path:pathlib.Path, size:int, ranges:list):
+    """
+    Record the remote file size and the remaining byte ranges of a range download, see _fetch_http_ranged.  
+    """
+    with _atomic_write(ranges_path) as tmp_path, open(tmp_path, 'w') as fh:
+        fh.write(f'{size}\n')
+        fh.writelines(f'{start}\t{end}\n' for start, end in ranges)
+
+def _read_ranges(ranges_path:pathlib.Path, size:int):
+    """
+    Read the remaining byte ranges of an interrupted range download, see _fetch_http_ranged.  
+
+    Returns:
+        list of [next byte, last byte] ranges, or None if there is no usable progress for a 
+        remote file of this size
+    """
+    try:
+        with open(ranges_path) as fh:
+            if int(fh.readline()) != size:
+                return None
+            return [[int(value) for value in line.split('\t')] for line in fh if line.strip()]
+    except (OSError, ValueError):
+        return None
+
+class _GzipToBgzfWriter:
+    """
+    File-like writer that decompresses a gzip stream on the fly and writes the data to fh in BGZF 
+    format (blocked gzip, see the SAM/BAM format specification). BGZF files are valid gzip files, 
+    but can also be indexed and read with random access by tools like samtools, bcftools or tabix. 
+    Converting while downloading saves a separate decompress/recompress pass over every file.  
+    Multi-member gzip input is supported. Use as a context manager: on exit without errors, the 
+    last block and the BGZF end-of-file marker are written.  
+
+    Args:
+        fh (file): binary file handle to write the BGZF data to
+        level (int): zlib compression level, defaults to 6
+    """
+    # maximum uncompressed size of a BGZF block, as used by htslib
+    BLOCK_SIZE = 0xff00
+    EOF_BLOCK = bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000000000000000')
+
+    def __init__(self, fh, level:int=6):
+        self._fh = fh
+        self._level = level
+        self._inflater = zlib.decompressobj(wbits=zlib.MAX_WBITS | 16) # gzip header and trailer
+        self._in_member = False
+        self._buffer = bytearray()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is None:
+            self.close()
+
+    def write(self, data:bytes):
+        while data:
+            self._buffer += self._inflater.decompress(data)
+            self._in_member = not self._inflater.eof
+            data = b''
+            if self._inflater.eof:
+                # anything after the end of a gzip member is the start of the next member
+                data = self._inflater.unused_data
+                self._inflater = zlib.decompressobj(wbits=zlib.MAX_WBITS | 16)
+        while len(self._buffer) >= self.BLOCK_SIZE:
+            self._write_block(self._buffer[:self.BLOCK_SIZE])
+            del self._buffer[:self.BLOCK_SIZE]
+
+    def close(self):
+        if self._in_member:
+            raise IOError('gzip stream ended unexpectedly')
+        if self._buffer:
+            self._write_block(self._buffer)
+            self._buffer = bytearray()
+        self._fh.write(self.EOF_BLOCK)
+
+    def _write_block(self, data:bytes):
+        deflater = zlib.compressobj(self._level, zlib.DEFLATED, -zlib.MAX_WBITS) # raw deflate
+        compressed = deflater.compress(data) + deflater.flush()
+        # gzip header with the BGZF extra field 'BC', which holds the total block size - 1
+        header = struct.pack('<4BI2BH2BHH', 31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2, len(compressed) + 25)
+        self._fh.write(header + compressed + struct.pack('<II', zlib.crc32(data), len(data)))
+
+class _FTPConnectionPool:
+    """
+    Keeps logged-in FTP control connections open per host, so that consecutive downloads from the 
+    same server skip the connect and login round trips. A connection is only used by one download 
+    at a time, so the pool can be shared between download threads. Use as a context manager to 
+    close all connections at the end.  
+    """
+    def __init__(self, timeout:int=60):
+        self._timeout = timeout
+        self._idle = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @contextmanager
+    def connection(self, host:str):
+        """
+        Context manager that provides an open FTP connection to host, reusing an idle one if possible
+        """
+        with self._lock:
+            ftp = self._idle[host].pop() if self._idle[host] else None
+        if ftp is None:
+            ftp = ftplib.FTP(timeout=self._timeout)
+            try:
+                ftp.connect(host)
+                ftp.login()
+            except BaseException:
+                # e.g. login refused, close the connected socket instead of leaking it
+                ftp.close()
+                raise
+        try:
+            yield ftp
+        except BaseException:
+            # the state of the control connection is unknown after an error, don't reuse it
+            _close_ftp(ftp)
+            raise
+        with self._lock:
+            self._idle[host].append(ftp)
+
+    def close(self):
+        """
+        Close all idle connections
+        """
+        with self._lock:
+            for connections in self._idle.values():
+                for ftp in connections:
+                    _close_ftp(ftp)
+            self._idle.clear()
+
+def _close_ftp(ftp:ftplib.FTP):
+    """
+    Close an FTP connection, ignoring errors (e.g. if the server has already closed it)
+    """
+    try:
+        ftp.quit()
+    except Exception:
+        ftp.close()
+
+@contextmanager
+def _atomic_write(path:pathlib.Path):
+    """
+    Context manager for writing a file in one step: provides a temporary path next to path, which 
+    is renamed to path when the block completes. Interrupted or concurrent writes therefore never 
+    leave behind an incomplete file at path. The temporary file is removed on errors.  
+
+    Args:
+        path (PosixPath): path of the file to write
+
+    Returns:
+        PosixPath of the temporary file to write to
+    """
+    path = pathlib.Path(path)
+    # unique per process and thread, for concurrent writers of the same file
+    tmp_path = path.with_name(f'{path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
 def cli_download_fastqs(args):
     """
     CLI function to run download_all_fastqs
@@ -477,7 +1198,13 @@ def cli_download_fastqs(args):
         ftp_url_read_2_col=args.ftp_url_read_2_col,
         run_accession_col=args.run_accession_col,
         skip_errors=args.skip_errors,
-        top3=args.top3
+        top3=args.top3,
+        jobs=args.jobs,
+        manifest_format=args.manifest_format,
+        protocol=args.protocol,
+        https_parts=args.https_parts,
+        bgzf=args.bgzf,
+        verify_existing=args.verify_existing
     )
     return 0
 
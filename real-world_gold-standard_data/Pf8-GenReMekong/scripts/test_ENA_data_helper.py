@@ -1,15 +1,48 @@
 import pytest
 from urllib.error import URLError
+import functools
 import gzip
+import http.server
+import os
+import re
+import threading
+import time
+import types
+import io
+import random
+import struct
+import zlib
 import pathlib
 import pandas as pd
-from ENA_data_helper import create_ena_data_frame, _build_ena_query, _search_ena, _parse_ena_response, merge_ena_results_into_sample_data_genre_pf8, _download_fastq_file, download_all_fastqs
+import ENA_data_helper
+from ENA_data_helper import create_ena_data_frame, _build_ena_query, _search_ena, _ena_search_cache_path, _parse_ena_response, merge_ena_results_into_sample_data_genre_pf8, _download_fastq_file, download_all_fastqs, _GzipToBgzfWriter, _fetch_url_to_file, _DownloadAborted
 
-def test_create_ena_data_frame():
+# three existing sample IDs from Pf8 (sample titles in ENA)
+SAMPLE_IDS = ['RCN13568','RCN13560','RCN15107']
+ENA_FIELDS = ['sample_title','run_accession','center_name','library_strategy','sample_accession','fastq_ftp','submitted_ftp']
+
+@pytest.fixture(scope='module')
+def ena_cache_dir(tmp_path_factory):
+    """
+    ENA search cache shared by the tests in this module, so the live search 
+    for SAMPLE_IDS only goes to ENA once per test session.  
+    """
+    return tmp_path_factory.mktemp('ena_cache')
+
+@pytest.fixture(scope='module')
+def ena_search_result(ena_cache_dir):
+    """
+    Raw ENA search result for SAMPLE_IDS. This runs a live query against the ENA search API.  
+    """
+    return _search_ena(samples=SAMPLE_IDS, return_fields=ENA_FIELDS, cache_dir=ena_cache_dir)
+
+@pytest.mark.network
+def test_create_ena_data_frame(ena_search_result, ena_cache_dir):
     data = pd.DataFrame(
-        {'sample':['RCN13568','RCN13560','RCN15107'],'some_other_data': [1,2,3] }
+        {'sample':SAMPLE_IDS,'some_other_data': [1,2,3] }
     )
-    ena_data = create_ena_data_frame(data, sample_id_col_name='sample')
+    # the search for these samples is already cached by the ena_search_result fixture
+    ena_data = create_ena_data_frame(data, sample_id_col_name='sample', cache_dir=ena_cache_dir)
     assert isinstance(ena_data, pd.DataFrame)
     assert len(ena_data)==12, 'the sample IDs are GenRe and Pf8 so should have 3 GenRe and 1 Pf8 result each = 12 in total'
 
@@ -22,6 +55,7 @@ def test_create_ena_data_frame():
     assert '_1.fastq' in fastq_ftp_result1, 'there should be a path to the read 1 file'
     assert '_2.fastq' in fastq_ftp_result1, 'there should be a path to the read 2 file'
     
+@pytest.mark.network
 def test_create_ena_data_frame_large():
     """
     Special case: test with a large number of sample IDs, which would throw a 
@@ -45,7 +79,7 @@ def test_create_ena_data_frame_large():
     data = pd.DataFrame(
         {'sample':sample_ids}
     )
-    # use a small chunk_size (default is 50) to trigger 3 searches
+    # use a small chunk_size (default is 2000) to trigger 3 searches
     ena_data = create_ena_data_frame(data, chunk_size=20)
     assert sorted(ena_data['sample'].unique()) == sorted(sample_ids), 'ENA results obtained for all sample IDs provided'
 
@@ -65,17 +99,14 @@ def test__parse_ena_response():
     assert len(ena_data) == 2,'2 rows of data'
     assert 'sample_title' in ena_data, 'expected column "sample_title" exists'
     
-def test__search_ena():
+@pytest.mark.network
+def test__search_ena(ena_search_result):
     """
-    This test will run a query against the ENA search API using three
+    This test uses the result of a query against the ENA search API using three
     real-world Pf8/GenRe sample IDs (="sample_title" in ENA).  
     If this test fails, make sure it is not an issue with your network connections.  
     """
-    # use three existing sample IDs from Pf8 (sample titles in ENA)
-    samples = ['RCN13568','RCN13560','RCN15107']
-    fields = ['sample_title','run_accession','center_name','library_strategy','sample_accession','fastq_ftp','submitted_ftp']
-
-    result = _search_ena(samples=samples,return_fields=fields)
+    result = ena_search_result
     assert result, 'should receive some results'
     assert isinstance(result, str), 'returns raw text'
     assert "\n" in result, 'result string contains line breaks (mutliple rows)'
@@ -83,6 +114,52 @@ def test__search_ena():
     assert "sample_title" in result, 'contains sample_title column name'
     assert 'RCN13568' in result, 'contains an expected sample ID (title)'
 
+def test__search_ena_cache(tmp_path):
+    """
+    A cached response is returned without querying ENA. The cache file is created 
+    here directly, so this test does not need network access.  
+    """
+    samples = ['RCN13568','RCN13560']
+    fields = ['sample_title','run_accession']
+    cached_text = 'sample_title\trun_accession\nRCN13568\tERR0000001\n'
+    cache_path = _ena_search_cache_path(tmp_path, samples, fields, 0)
+    with gzip.open(cache_path, 'wt') as f:
+        f.write(cached_text)
+
+    result = _search_ena(samples=samples, return_fields=fields, cache_dir=tmp_path)
+    assert result == cached_text, 'cached response is returned'
+    assert _ena_search_cache_path(tmp_path, list(reversed(samples)), fields, 0) == cache_path, 'cache key does not depend on sample order'
+
+class _TooLargeSession:
+    """
+    Stand-in for a requests.Session that rejects searches for more than one sample with HTTP 413 
+    and answers single-sample searches with rows, or an empty body if there are none.  
+    """
+    def __init__(self, rows:dict):
+        self.rows = rows
+
+    def post(self, url, data, timeout):
+        samples = re.findall(r'RCN\d+', data['query'])
+        if len(samples) > 1:
+            return types.SimpleNamespace(status_code=413)
+        body = self.rows.get(samples[0], '')
+        content = f'run_accession\tsample_title\n{body}' if body else ''
+        return types.SimpleNamespace(status_code=200, content=content.encode('utf-8'), raise_for_status=lambda: None)
+
+def test__search_ena_split():
+    """
+    Requests rejected as too large are split and the responses joined with a single header, also 
+    when some of the halves have no results.  
+    """
+    session = _TooLargeSession({'RCN13560': 'ERR0000001\tRCN13560\nERR0000002\tRCN13560\n', 'RCN15107': 'ERR0000003\tRCN15107\n'})
+    expected = 'run_accession\tsample_title\nERR0000001\tRCN13560\nERR0000002\tRCN13560\nERR0000003\tRCN15107\n'
+    result = _search_ena(samples=['RCN13568', 'RCN13560', 'RCN15107'], return_fields=['run_accession', 'sample_title'], session=session)
+    assert result == expected, 'header is kept if the first half has no results'
+    result = _search_ena(samples=['RCN13560', 'RCN15107', 'RCN13568'], return_fields=['run_accession', 'sample_title'], session=session)
+    assert result == expected, 'header is kept if the last half has no results'
+    result = _search_ena(samples=['RCN13568', 'RCN13569'], return_fields=['run_accession', 'sample_title'], session=session)
+    assert result == '', 'no results for any half gives an empty response'
+
 def test_merge_ena_results_into_sample_data_genre_pf8():
     # mock ENA result DataFrame, created after a real-world query but modified for brevity. 
     ena_result = pd.DataFrame(
@@ -104,11 +181,45 @@ def test_merge_ena_results_into_sample_data_genre_pf8():
     merged_data = merge_ena_results_into_sample_data_genre_pf8(sample_data=sample_data, ena_result=ena_result)
 
     assert len(merged_data) == 2, 'the merged data has two rows, exactly as input sample data'
-    assert merged_data.at['RCN15107','ENA_acc_GenRe_SPEC']=='ERR14392568','sample RCN15107 GenRE SPEC accession is correctly inferred from data'
-    assert merged_data.at['RCN13560','ENA_acc_Pf8']=='ERR15626087','sample RCN13560 Pf8 accession is correctly inferred from data'
+    assert merged_data.at['RCN15107','INSDC_GenRe_SPEC']=='ERR14392568','sample RCN15107 GenRE SPEC accession is correctly inferred from data'
+    assert merged_data.at['RCN13560','INSDC_Pf8']=='ERR15626087','sample RCN13560 Pf8 accession is correctly inferred from data'
     assert merged_data.at['RCN13560','GenRe_GRC2_ENA_FASTQ_FTP_1']=='ftp://some3/read1.fastq.gz','sample RCN13560 Pf8 read 1 FTP link is correctly extracted from ENA data and protocol prepended'
     assert merged_data.at['RCN13560','GenRe_GRC2_ENA_FASTQ_FTP_2']=='ftp://some3/read2.fastq.gz','sample RCN13560 Pf8 read 1 FTP link is correctly extracted from ENA data and protocol prepended'
 
+def test_merge_ena_results_into_sample_data_genre_pf8_empty():
+    """
+    No ENA results to merge, either because the search found nothing or because all rows 
+    failed the sanity checks and were skipped: all new columns exist and are empty.  
+    """
+    sample_data = pd.DataFrame(
+        {'sample':['RCN15107', 'RCN13560'],'some_other_data': [1,2] }
+    )
+    # ENA response without any hits, only the header line
+    ena_result = _parse_ena_response(
+        'run_accession\tsample_title\tcenter_name\tlibrary_strategy\tsample_accession\tfastq_ftp\tsubmitted_ftp\n'
+    ).rename(columns={'sample_title': 'sample'})
+    merged_data = merge_ena_results_into_sample_data_genre_pf8(sample_data=sample_data, ena_result=ena_result)
+    assert len(merged_data) == 2, 'the merged data has two rows, exactly as input sample data'
+    assert merged_data.at['RCN15107','INSDC_GenRe_SPEC'] is None, 'no accession for a sample without results'
+    assert merged_data.at['RCN13560','Pf8_ENA_FASTQ_FTP_2'] is None, 'no FTP link for a sample without results'
+
+    # a single GenRe row with the wrong library strategy, skipped with skip_errors
+    ena_result = pd.DataFrame(
+        {
+            'run_accession': ['ERR14392568'], 
+            'sample': ['RCN15107'], 
+            'center_name': ['GenRe-Mekong'], 
+            'library_strategy': ['WGS'], 
+            'fastq_ftp': ['some1/read1.fastq.gz;some1/read2.fastq.gz'],
+            'submitted_ftp': ['some1/sample_SPEC.cram']
+        }
+    )
+    merged_data = merge_ena_results_into_sample_data_genre_pf8(sample_data=sample_data, ena_result=ena_result, skip_errors=True)
+    assert len(merged_data) == 2, 'the merged data has two rows, exactly as input sample data'
+    assert merged_data.at['RCN15107','INSDC_GenRe_SPEC'] is None, 'the skipped row is not merged'
+    assert merged_data.at['RCN15107','GenRe_SPEC_ENA_FASTQ_FTP_1'] is None, 'the skipped row is not merged'
+
+@pytest.mark.network
 def test__download_fastq_file(tmp_path):
     # NOTE: this is a real SRA FTP path and relies on a file existing on the 
     # third-party resource. The test may fail because the file was removed remotely
@@ -122,6 +233,79 @@ def test__download_fastq_file(tmp_path):
     with pytest.raises(Exception, match='Failed to download'):
         _download_fastq_file( remote_ftp_url, tmp_path)
 
+def test_download_all_fastqs_failure_stops_downloads(tmp_path, monkeypatch):
+    """
+    A failed download stops the other running downloads instead of waiting for them to finish. 
+    Transfers are replaced by a stub, one fails right away and one would take 5 seconds.  
+    """
+    aborted = []
+    def fetch_stub(url, local_path, abort=None, **kwargs):
+        if 'ERR1_1' in url:
+            time.sleep(0.1)
+            raise IOError('connection lost')
+        for _ in range(100):
+            if abort.is_set():
+                aborted.append(url)
+            ENA_data_helper._check_abort(abort)
+            time.sleep(0.05)
+        local_path.touch()
+    monkeypatch.setattr(ENA_data_helper, '_fetch_url_to_file', fetch_stub)
+
+    data = pd.DataFrame(
+        {
+            'run_accession': ['ERR1'],
+            'ftp_url_read_1': ['ftp.sra.ebi.ac.uk/ERR1_1.fastq.gz'],
+            'ftp_url_read_2': ['ftp.sra.ebi.ac.uk/ERR1_2.fastq.gz']
+        }
+    )
+    start = time.monotonic()
+    with pytest.raises(Exception, match='Failed to download'):
+        download_all_fastqs(data=data, outdir=tmp_path, num_tries=1)
+    assert time.monotonic() - start < 2, 'the failure is raised without waiting for the other download'
+    time.sleep(0.2)
+    assert aborted == ['ftp://ftp.sra.ebi.ac.uk/ERR1_2.fastq.gz'], 'the other download is stopped'
+    assert not (tmp_path / 'ERR1_2.fastq.gz').exists(), 'the stopped download does not create its file'
+
+def test__download_fastq_file_existing(tmp_path):
+    """
+    An existing local file is not downloaded again. The remote URL does not exist, 
+    so this only passes if no download is attempted.  
+    """
+    existing_path = tmp_path / 'EXISTING_1.fastq.gz'
+    existing_path.write_bytes(b'\x1f\x8b')
+    remote_ftp_url = 'ftp://ftp.sra.ebi.ac.uk/vol1/fastq/THIS_DOES_NOT_EXIST/EXISTING_1.fastq.gz'
+    local_path = _download_fastq_file(remote_ftp_url, tmp_path)
+    assert local_path == str(existing_path.resolve()), 'method returns the path of the existing file'
+    assert existing_path.read_bytes() == b'\x1f\x8b', 'the existing file is unchanged'
+
+def test_download_all_fastqs_duplicate_files(tmp_path, monkeypatch):
+    """
+    Rows that refer to the same FASTQ file share a single download, so that concurrent 
+    downloads never write to the same file. Downloads are replaced by a stub, no network access needed.  
+    """
+    downloaded_urls = []
+    def download_stub(remote_ftp_url, dir, **kwargs):
+        downloaded_urls.append(remote_ftp_url)
+        return str(pathlib.Path(dir) / remote_ftp_url.split('/')[-1])
+    monkeypatch.setattr(ENA_data_helper, '_download_fastq_file', download_stub)
+
+    data = pd.DataFrame(
+        {
+            'run_accession': ['ERR1', 'ERR2', 'ERR1'],
+            'ftp_url_read_1': ['ftp.sra.ebi.ac.uk/ERR1_1.fastq.gz', 'ftp.sra.ebi.ac.uk/ERR2_1.fastq.gz', 'ftp.sra.ebi.ac.uk/ERR1_1.fastq.gz'],
+            'ftp_url_read_2': ['ftp.sra.ebi.ac.uk/ERR1_2.fastq.gz', 'ftp.sra.ebi.ac.uk/ERR2_2.fastq.gz', 'ftp.sra.ebi.ac.uk/ERR1_2.fastq.gz']
+        }
+    )
+    download_all_fastqs(data=data, outdir=tmp_path)
+    assert sorted(downloaded_urls) == sorted(set(downloaded_urls)), 'every file is downloaded only once'
+    assert len(downloaded_urls) == 4, 'all distinct files are downloaded'
+
+    manifest = pd.read_csv(tmp_path / 'manifest.csv')
+    assert len(manifest) == 3, 'the manifest has one row per input row'
+    assert (tmp_path / 'manifest.csv').read_bytes().count(b'\r\n') == 4, 'manifest lines end with CRLF like the csv module writes them'
+    assert manifest.at[2, 'read_1_file'] == manifest.at[0, 'read_1_file'], 'the shared download is used for both rows'
+
+@pytest.mark.network
 def test_download_all_fastqs(tmp_path):
     data = pd.DataFrame(
         {
@@ -163,4 +347,246 @@ def test_download_all_fastqs(tmp_path):
     with pytest.raises(ValueError, match='data is missing columns'):
         download_all_fastqs(data=data,outdir=tmp_path)
         
-    assert download_all_fastqs(data=data,outdir=tmp_path, run_accession_col='accession'),'non-default col name correctly applied'
\ No newline at end of file
+    assert download_all_fastqs(data=data,outdir=tmp_path, run_accession_col='accession'),'non-default col name correctly applied'
+
+def _fastq_text(n_reads, seed):
+    rng = random.Random(seed)
+    return ''.join(
+        f'@read{i}\n{"".join(rng.choice("ACGT") for _ in range(100))}\n+\n{"I" * 100}\n' 
+        for i in range(n_reads)).encode()
+
+def test__GzipToBgzfWriter():
+    """
+    Multi-member gzip input, fed in odd-sized chunks, is converted to valid BGZF blocks.  
+    """
+    data = [_fastq_text(800, seed=1), _fastq_text(300, seed=2)]
+    gzip_data = b''.join(gzip.compress(member) for member in data)
+    out = io.BytesIO()
+    with _GzipToBgzfWriter(out) as writer:
+        for i in range(0, len(gzip_data), 7777):
+            writer.write(gzip_data[i:i + 7777])
+    bgzf_data = out.getvalue()
+
+    assert gzip.decompress(bgzf_data) == b''.join(data), 'BGZF output is valid gzip with the original content'
+    assert bgzf_data.endswith(_GzipToBgzfWriter.EOF_BLOCK), 'BGZF output ends with the EOF marker block'
+
+    # check the framing of every block
+    pos = 0
+    blocks = []
+    while pos < len(bgzf_data):
+        id1, id2, cm, flg, xlen, si1, si2, slen, bsize = struct.unpack_from('<4B6xH2BHH', bgzf_data, pos)
+        assert (id1, id2, cm, flg) == (31, 139, 8, 4), 'gzip header with FEXTRA flag'
+        assert (xlen, si1, si2, slen) == (6, 66, 67, 2), 'BGZF extra field "BC"'
+        block = bgzf_data[pos:pos + bsize + 1]
+        crc, isize = struct.unpack_from('<II', block, len(block) - 8)
+        uncompressed = zlib.decompress(block[18:-8], -zlib.MAX_WBITS)
+        assert len(uncompressed) == isize <= _GzipToBgzfWriter.BLOCK_SIZE, 'ISIZE matches block content'
+        assert zlib.crc32(uncompressed) == crc, 'CRC32 matches block content'
+        blocks.append(uncompressed)
+        pos += bsize + 1
+    assert pos == len(bgzf_data), 'BSIZE of the last block ends at the end of the file'
+    assert blocks[-1] == b'', 'last block is the empty EOF block'
+    assert len(blocks) > 3, 'data is split into several blocks'
+
+    # truncated input, the error is raised when the writer is closed on leaving the with block
+    with pytest.raises(IOError, match='ended unexpectedly'):
+        with _GzipToBgzfWriter(io.BytesIO()) as writer:
+            writer.write(gzip_data[:-100])
+
+class _RangeRequestHandler(http.server.SimpleHTTPRequestHandler):
+    """
+    Serves files from a directory with support for HTTP range requests. If fail_after is set, 
+    the data of every response is cut off after this many bytes, like an interrupted transfer. 
+    The methods of all requests and the byte ranges of range requests are recorded.  
+    """
+    fail_after = None
+    requested_methods = []
+    requested_ranges = []
+
+    def log_message(self, *args):
+        pass
+
+    def send_head(self):
+        type(self).requested_methods.append(self.command)
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return None
+        size = os.path.getsize(path)
+        fh = open(path, 'rb')
+        match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if match:
+            start = int(match[1])
+            end = int(match[2]) if match[2] else size - 1
+            type(self).requested_ranges.append((start, end))
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+            fh.seek(start)
+            self._length = end - start + 1
+        else:
+            self.send_response(200)
+            self._length = size
+        self.send_header('Content-Length', str(self._length))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+        return fh
+
+    def copyfile(self, source, outputfile):
+        length = self._length if self.fail_after is None else min(self._length, self.fail_after)
+        outputfile.write(source.read(length))
+
+@pytest.fixture(scope='module')
+def http_server(tmp_path_factory):
+    """
+    Local HTTP server for download tests without network access. Yields the base URL and the 
+    directory that is served.  
+    """
+    root = tmp_path_factory.mktemp('www')
+    handler = functools.partial(_RangeRequestHandler, directory=str(root))
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_address[1]}', root
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def remote_file(http_server, monkeypatch):
+    """
+    A file served by the local HTTP server, returns its URL and content. Small download blocks 
+    make sure that interrupted transfers have written some data before they fail.  
+    """
+    base_url, root = http_server
+    content = random.Random(3).randbytes(300000)
+    (root / 'ERR1_1.fastq.gz').write_bytes(content)
+    monkeypatch.setattr(_RangeRequestHandler, 'fail_after', None)
+    monkeypatch.setattr(_RangeRequestHandler, 'requested_methods', [])
+    monkeypatch.setattr(_RangeRequestHandler, 'requested_ranges', [])
+    monkeypatch.setattr(ENA_data_helper, 'DOWNLOAD_BUFFER_SIZE', 8192)
+    return f'{base_url}/ERR1_1.fastq.gz', content
+
+@pytest.mark.parametrize('https_parts', [1, 4])
+def test__fetch_url_to_file_http(tmp_path, remote_file, https_parts):
+    url, content = remote_file
+    local_path = tmp_path / 'ERR1_1.fastq.gz'
+    _fetch_url_to_file(url, local_path, https_parts=https_parts)
+    assert local_path.read_bytes() == content, 'downloaded file is identical to the remote file'
+    assert sorted(os.listdir(tmp_path)) == ['ERR1_1.fastq.gz'], 'no partial files are left behind'
+
+def test__fetch_url_to_file_http_resume(tmp_path, remote_file):
+    url, content = remote_file
+    local_path = tmp_path / 'ERR1_1.fastq.gz'
+    part_path = tmp_path / 'ERR1_1.fastq.gz.part'
+
+    _RangeRequestHandler.fail_after = 100000
+    with pytest.raises(Exception):
+        _fetch_url_to_file(url, local_path, https_parts=1)
+    assert not local_path.exists(), 'an interrupted download does not create the final file'
+    part_size = part_path.stat().st_size
+    assert 0 < part_size <= 100000, 'the partial file holds the data received so far'
+
+    _RangeRequestHandler.fail_after = None
+    _fetch_url_to_file(url, local_path, https_parts=1)
+    assert _RangeRequestHandler.requested_ranges == [(part_size, len(content) - 1)], 'the download is resumed at the end of the partial file'
+    assert local_path.read_bytes() == content, 'resumed file is identical to the remote file'
+    assert not part_path.exists(), 'the partial file is renamed to the final file'
+
+def test__fetch_url_to_file_http_ranged_resume(tmp_path, remote_file):
+    url, content = remote_file
+    local_path = tmp_path / 'ERR1_1.fastq.gz'
+    ranges_path = tmp_path / 'ERR1_1.fastq.gz.part.ranges'
+
+    _RangeRequestHandler.fail_after = 30000
+    with pytest.raises(Exception):
+        _fetch_url_to_file(url, local_path, https_parts=4)
+    assert ranges_path.exists(), 'the progress of an interrupted range download is recorded'
+    ranges = [tuple(int(value) for value in line.split('\t')) for line in ranges_path.read_text().splitlines()[1:]]
+    assert [end for _, end in ranges] == [74999, 149999, 224999, 299999], 'four ranges are recorded'
+    assert all(start > end - 75000 + 1 for start, end in ranges), 'every range has made some progress'
+
+    _RangeRequestHandler.fail_after = None
+    _RangeRequestHandler.requested_ranges = []
+    _fetch_url_to_file(url, local_path, https_parts=4)
+    assert sorted(_RangeRequestHandler.requested_ranges) == ranges, 'only the missing part of every range is downloaded'
+    assert local_path.read_bytes() == content, 'resumed file is identical to the remote file'
+    assert sorted(os.listdir(tmp_path)) == ['ERR1_1.fastq.gz'], 'the partial file and its ranges file are removed'
+
+def test__fetch_url_to_file_http_ranged_then_single(tmp_path, remote_file):
+    """
+    A partial file from an interrupted range download has gaps and can't be resumed by a 
+    single-stream transfer, which has to start from the beginning.  
+    """
+    url, content = remote_file
+    local_path = tmp_path / 'ERR1_1.fastq.gz'
+
+    _RangeRequestHandler.fail_after = 30000
+    with pytest.raises(Exception):
+        _fetch_url_to_file(url, local_path, https_parts=4)
+
+    _RangeRequestHandler.fail_after = None
+    _RangeRequestHandler.requested_ranges = []
+    _fetch_url_to_file(url, local_path, https_parts=1)
+    assert _RangeRequestHandler.requested_ranges == [], 'the file is downloaded from the beginning'
+    assert local_path.read_bytes() == content, 'downloaded file is identical to the remote file'
+    assert sorted(os.listdir(tmp_path)) == ['ERR1_1.fastq.gz'], 'the partial file and its ranges file are removed'
+
+def test__fetch_url_to_file_http_bgzf_then_plain(tmp_path, http_server, remote_file):
+    """
+    The partial file of an interrupted BGZF conversion holds recompressed data, a plain download 
+    afterwards must not resume from it.  
+    """
+    base_url, root = http_server
+    content = gzip.compress(_fastq_text(2000, seed=5), mtime=0)
+    (root / 'ERR2_1.fastq.gz').write_bytes(content)
+    url = f'{base_url}/ERR2_1.fastq.gz'
+    local_path = tmp_path / 'ERR2_1.fastq.gz'
+
+    _RangeRequestHandler.fail_after = len(content) // 2
+    with pytest.raises(Exception):
+        _fetch_url_to_file(url, local_path, https_parts=1, bgzf=True)
+    assert (tmp_path / 'ERR2_1.fastq.gz.part.bgzf').stat().st_size > 0, 'the BGZF data received so far is kept'
+
+    _RangeRequestHandler.fail_after = None
+    _RangeRequestHandler.requested_ranges = []
+    _fetch_url_to_file(url, local_path, https_parts=1)
+    assert _RangeRequestHandler.requested_ranges == [], 'the plain download starts from the beginning'
+    assert local_path.read_bytes() == content, 'downloaded file is identical to the remote file'
+
+@pytest.mark.parametrize('https_parts', [1, 4])
+def test__fetch_url_to_file_http_abort(tmp_path, remote_file, https_parts):
+    url, content = remote_file
+    local_path = tmp_path / 'ERR1_1.fastq.gz'
+    abort = threading.Event()
+    abort.set()
+    with pytest.raises(_DownloadAborted):
+        _fetch_url_to_file(url, local_path, https_parts=https_parts, abort=abort)
+    assert not local_path.exists(), 'an aborted download does not create the final file'
+
+@pytest.fixture
+def ena_remote_file(remote_file, monkeypatch):
+    """
+    The file of remote_file, downloaded by _download_fastq_file from an ENA-style FTP URL 
+    that is redirected to the local HTTP server.  
+    """
+    url, content = remote_file
+    monkeypatch.setattr(ENA_data_helper, '_resolve_download', 
+        lambda remote_ftp_url, dir, protocol='ftp': (url, (pathlib.Path(dir) / url.split('/')[-1]).resolve()))
+    return 'ftp.sra.ebi.ac.uk/vol1/fastq/ERR1/ERR1_1.fastq.gz', content
+
+def test__download_fastq_file_verify_existing_mismatch(tmp_path, ena_remote_file):
+    remote_ftp_url, content = ena_remote_file
+    existing_path = tmp_path / 'ERR1_1.fastq.gz'
+    existing_path.write_bytes(content[:1000])
+    local_path = _download_fastq_file(remote_ftp_url, tmp_path, https_parts=1, verify_existing=True)
+    assert local_path == str(existing_path.resolve()), 'method returns the path of the local file'
+    assert existing_path.read_bytes() == content, 'a file with a different size is downloaded again'
+
+def test__download_fastq_file_verify_existing_match(tmp_path, ena_remote_file):
+    remote_ftp_url, content = ena_remote_file
+    existing_path = tmp_path / 'ERR1_1.fastq.gz'
+    existing_data = bytes(len(content))
+    existing_path.write_bytes(existing_data)
+    local_path = _download_fastq_file(remote_ftp_url, tmp_path, https_parts=1, verify_existing=True)
+    assert local_path == str(existing_path.resolve()), 'method returns the path of the local file'
+    assert existing_path.read_bytes() == existing_data, 'a file with the remote size is kept'
+    assert _RangeRequestHandler.requested_methods == ['HEAD'], 'only the size of the remote file is requested'
+
@@ -1,20 +1,34 @@
 #!/usr/bin/env python3
+import os
 import sys
 import re
+import mmap
+import bisect
+import pickle
+from array import array
 from collections import defaultdict
+from contextlib import contextmanager
+
+# FASTA header line, the sequence ID is the first word after '>'
+_HEADER_RE = re.compile(r'^> *(\S+)')
+# complement of (uppercased) bases, other characters such as N are kept as they are
+_RC_TABLE = str.maketrans('ACGT', 'TGCA')
+# FASTA indexes loaded by _load_or_build_fai: path -> ((mtime, size) of the FASTA file, index)
+_FAI_CACHE = {}
+# GFF files parsed by _load_gff_index: path -> ((mtime, size) of the GFF file, parsed data)
+_GFF_CACHE = {}
+# format version of the GFF cache files written by _load_gff_index, to be increased when _parse_gff changes
+_GFF_CACHE_VERSION = 1
 
 def parse_attributes(attr_str):
     """Parse GFF attribute column into dict."""
     attrs = {}
     for part in attr_str.strip().split(";"):
-        if not part:
-            continue
-        if "=" in part:
-            k,v = part.split("=",1)
-            attrs[k] = v
-        elif " " in part:
+        k,sep,v = part.partition("=")
+        if not sep:
             # fallback for space-separated key value
-            k,v = part.split(" ",1)
+            k,sep,v = part.partition(" ")
+        if sep:
             attrs[k] = v
     return attrs
 
@@ -23,45 +37,12 @@ def find_cds_for_gene(gff_path, query):
     Returns:
       chrom (seqid), strand (+1 or -1), list of (start,end) tuples for CDS in transcript order,
       matched_ids -> list of attribute IDs found (for debugging)
+    NOTE: the GFF file is parsed once and kept in memory (see _load_gff_index), 
+    so further queries against the same file don't parse it again.
     """
-    # Map parent/id -> list of CDS tuples and seqid/strand
-    cds_by_parent = defaultdict(list)
+    seqids, starts, ends, strands, cds_by_parent, attr_values = _load_gff_index(gff_path)
     # Track any attributes seen that contain query (for diagnostics)
-    matching_attrs = set()
-    # Also track lines where gene/transcript types include query
-    candidate_lines = []
-
-    with open(gff_path) as fh:
-        for line in fh:
-            if line.startswith("#") or not line.strip():
-                continue
-            cols = line.rstrip("\n").split("\t")
-            if len(cols) < 9:
-                continue
-            seqid, source, ftype, start_s, end_s, score, strand_s, phase, attr_s = cols
-            start = int(start_s)
-            end = int(end_s)
-            attrs = parse_attributes(attr_s)
-
-            # Check common attribute keys for matching
-            for key in ("ID","Parent","Name","gene_id","transcript_id","Dbxref"):
-                val = attrs.get(key)
-                if val and query in val:
-                    matching_attrs.add(f"{key}={val}")
-                    candidate_lines.append((seqid, ftype, start, end, strand_s, attrs))
-
-            # If it's a CDS, record under its Parent (often "Parent=PF3D7_0709000.1")
-            if ftype == "CDS":
-                parent = attrs.get("Parent") or attrs.get("Gene") or attrs.get("Transcript")
-                # Parent can be comma-separated
-                if parent:
-                    for p in parent.split(","):
-                        cds_by_parent[p].append((seqid, start, end, strand_s))
-                else:
-                    # fallback: sometimes ID is used for CDS
-                    cid = attrs.get("ID")
-                    if cid:
-                        cds_by_parent[cid].append((seqid, start, end, strand_s))
+    matching_attrs = {f"{key}={val}" for key, val in attr_values if query in val}
 
     # If we found no matching_attrs, try scanning names that contain the short query substring
     if not matching_attrs:
@@ -71,35 +52,14 @@ def find_cds_for_gene(gff_path, query):
             for p in candidates:
                 matching_attrs.add(f"Parent_contains={p}")
 
-    # Build final CDS list by selecting parents that match
-    chosen = None
-    cds_list = []
-    chrom = None
-    strand = None
-    for parent, cds_entries in cds_by_parent.items():
-        if query in parent or any(query in m for m in matching_attrs):
-            # prefer parent matches
-            if query in parent:
-                chosen = parent
-                cds_list = cds_entries
-                break
-
-    # If not chosen, but there are matching_attrs that point to IDs, try to pick one
+    # Build final CDS list from the best matching parent, in order of preference: 
+    # exact ID, a transcript of the queried gene (ID with .1 etc. suffix), any ID containing the query
+    chosen = query if query in cds_by_parent else None
     if chosen is None:
-        # pick any parent that contains the query substring
-        for parent in cds_by_parent:
-            if query in parent:
-                chosen = parent
-                cds_list = cds_by_parent[parent]
-                break
-
-    # If still no cds_list, try any parent where the ID startswith query (useful for .1 suffix)
-    if not cds_list:
-        for parent in cds_by_parent:
-            if parent.startswith(query):
-                chosen = parent
-                cds_list = cds_by_parent[parent]
-                break
+        chosen = next((p for p in cds_by_parent if p.startswith(query + ".")), None)
+    if chosen is None:
+        chosen = next((p for p in cds_by_parent if query in p), None)
+    cds_list = [(seqids[i], starts[i], ends[i], strands[i]) for i in cds_by_parent[chosen]] if chosen is not None else []
 
     # If still empty, return diagnostics
     if not cds_list:
@@ -125,23 +85,143 @@ def find_cds_for_gene(gff_path, query):
     exons_norm = [(int(a), int(b)) for a,b in exons]
     return chrom, strand, exons_norm, sorted(matching_attrs)
 
+def _load_gff_index(gff_path):
+    """
+    gff_path: path (str) to GFF file
+    returns the GFF data used by find_cds_for_gene, see _parse_gff.
+    Parsed GFF files are kept in memory until the file changes. They are also saved to a cache 
+    file next to the GFF (gff_path + '.cdscache.pickle') if possible, so that later runs of 
+    the script don't need to parse the GFF again.
+    """
+    gff_stat = os.stat(gff_path)
+    key = (gff_stat.st_mtime_ns, gff_stat.st_size)
+    cached = _GFF_CACHE.get(gff_path)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+
+    cache_file = f'{gff_path}.cdscache.pickle'
+    gff_index = None
+    try:
+        with open(cache_file, 'rb') as fh:
+            version, cache_key, cached_index = pickle.load(fh)
+        if version == _GFF_CACHE_VERSION and cache_key == key:
+            gff_index = cached_index
+    except Exception:
+        pass # no cache file yet, or an unreadable one that is replaced below
+    if gff_index is None:
+        gff_index = _parse_gff(gff_path)
+        try:
+            with _atomic_write(cache_file) as tmp_file, open(tmp_file, 'wb') as fh:
+                pickle.dump((_GFF_CACHE_VERSION, key, gff_index), fh, protocol=pickle.HIGHEST_PROTOCOL)
+        except OSError:
+            pass # e.g. read-only directory, the parsed GFF is still kept in memory
+
+    _GFF_CACHE[gff_path] = (key, gff_index)
+    return gff_index
+
+def _parse_gff(gff_path):
+    """
+    gff_path: path (str) to GFF file
+    returns tuple of
+      seqids, starts, ends, strands: columns of a table with one row per CDS line,
+      cds_by_parent: dict of parent (or CDS) ID -> list of row numbers in the CDS table,
+      attr_values: list of (key, value) of the attributes that find_cds_for_gene matches the query against
+    """
+    # CDS table, stored column-wise. Coordinates are kept in compact integer arrays, 
+    # seqid and strand strings are interned so that rows share them
+    seqids = []
+    starts = array('l')
+    ends = array('l')
+    strands = []
+    # Map parent/id -> list of CDS table rows
+    cds_by_parent = defaultdict(list)
+    # distinct attribute values to match queries against, a dict keeps them in file order
+    attr_values = {}
+
+    with open(gff_path) as fh:
+        for line in fh:
+            if line.startswith("#") or not line.strip():
+                continue
+            cols = line.rstrip("\n").split("\t")
+            if len(cols) < 9:
+                continue
+            seqid, source, ftype, start_s, end_s, score, strand_s, phase, attr_s = cols
+            start = int(start_s)
+            end = int(end_s)
+            attrs = parse_attributes(attr_s)
+
+            # Check common attribute keys for matching
+            for key in ("ID","Parent","Name","gene_id","transcript_id","Dbxref"):
+                val = attrs.get(key)
+                if val:
+                    attr_values[(key, val)] = None
+
+            # If it's a CDS, record under its Parent (often "Parent=PF3D7_0709000.1")
+            if ftype == "CDS":
+                parent = attrs.get("Parent") or attrs.get("Gene") or attrs.get("Transcript")
+                # Parent can be comma-separated, fallback: sometimes ID is used for CDS
+                cds_ids = parent.split(",") if parent else [attrs["ID"]] if attrs.get("ID") else []
+                if cds_ids:
+                    row = len(seqids)
+                    seqids.append(sys.intern(seqid))
+                    starts.append(start)
+                    ends.append(end)
+                    strands.append(sys.intern(strand_s))
+                    for p in cds_ids:
+                        cds_by_parent[p].append(row)
+
+    return seqids, starts, ends, strands, dict(cds_by_parent), list(attr_values)
+
 def aa_to_genomic_from_exons(exons, aa_pos, strand):
     """
     exons: list of (start,end) in transcript order (1-based inclusive)
     aa_pos: 1-based amino acid position
     returns (genomic_start, genomic_end) inclusive (1-based)
+    NOTE: for many positions in the same gene, build the exon index once with build_exon_index 
+    and use aa_to_genomic_batch instead.
+    """
+    return aa_to_genomic_batch([aa_pos], build_exon_index(exons), strand)[0]
+
+def build_exon_index(exons):
+    """
+    exons: list of (start,end) in transcript order (1-based inclusive)
+    returns exon index for aa_to_genomic_batch: tuple of the exons and a list with the 
+    1-based CDS position of the first base of each exon
+    """
+    cds_starts = []
+    running = 0
+    for start,end in exons:
+        cds_starts.append(running + 1)
+        running += end - start + 1
+    return exons, cds_starts
+
+def aa_to_genomic_batch(aa_positions, exon_index, strand):
+    """
+    aa_positions: iterable of 1-based amino acid positions
+    exon_index: exon index of the gene, see build_exon_index
+    strand: strand (int, 1:'+', -1:'-')
+    returns list of (genomic_start, genomic_end) inclusive (1-based), one per amino acid position
+    """
+    return [_aa_to_genomic(exon_index, aa_pos, strand) for aa_pos in aa_positions]
+
+def _aa_to_genomic(exon_index, aa_pos, strand):
+    """
+    Genomic coordinates of a single codon, see aa_to_genomic_batch.
     """
+    exons, cds_starts = exon_index
     # codon positions in CDS (1-based)
     codon_start_cds = (aa_pos - 1) * 3 + 1
     codon_end_cds = codon_start_cds + 2
 
-    # iterate exons accumulating length
-    running = 0
+    # look up the exon containing the first base of the codon, then only visit the 
+    # exons that overlap the codon (more than one if the codon spans an exon junction)
     g_positions = []
-    for start,end in exons:
-        exon_len = end - start + 1
-        exon_cds_start = running + 1
-        exon_cds_end = running + exon_len
+    for i in range(max(bisect.bisect_right(cds_starts, codon_start_cds) - 1, 0), len(exons)):
+        exon_cds_start = cds_starts[i]
+        if exon_cds_start > codon_end_cds:
+            break
+        start,end = exons[i]
+        exon_cds_end = exon_cds_start + end - start
         # overlap?
         overlap_start = max(exon_cds_start, codon_start_cds)
         overlap_end = min(exon_cds_end, codon_end_cds)
@@ -161,7 +241,6 @@ def aa_to_genomic_from_exons(exons, aa_pos, strand):
                 # ensure g_s <= g_e
                 g_s, g_e = min(g_s,g_e), max(g_s,g_e)
             g_positions.append((g_s, g_e))
-        running += exon_len
 
     if not g_positions:
         raise ValueError("Codon not found within exons (check aa_pos and exon boundaries).")
@@ -187,34 +266,156 @@ def sequence_for_pos(fasta_file, chrom, strand, start, end):
     start: 1-based start pos
     end: 1-based end pos
     returns NA sequence at given position (str)
-    NOTE: this is a very simple FASTA parser that doesn't do any error handling
+    NOTE: this is a very simple FASTA parser that doesn't do any error handling.
+    The position is read directly from the file using a FASTA index (.fai), which is built 
+    on the first call (see _load_or_build_fai). FASTA files that can't be indexed because 
+    of irregular line lengths are scanned instead.
     """
-    seek=False
-    seq=''
-    with open(fasta_file) as fh:
-        for line in fh:
-            line=line.strip()
-            if line.startswith('>'):
-                seek=False
-                seq_id=re.match(r'^> *(\S+).*', line)[1]
-                if seq_id.lower()==chrom.lower():
-                    seek=True
-            elif seek:
-                seq=seq+line
-                if len(seq)>=end:
-                    if strand==1:
-                        return seq[start-1:end]
-                    else:
-                        return _revcom(seq[start-1:end])
+    fai = _load_or_build_fai(fasta_file)
+    if fai is None:
+        return _sequence_for_pos_scan(fasta_file, chrom, strand, start, end)
+
+    entry = fai.get(chrom.lower())
+    if entry is None or entry[0] < end:
+        raise ValueError('could not find chromosome or requested position in chromosome')
+    length, offset, line_bases, line_bytes = entry
+    # byte positions of the first and last base, accounting for the line breaks before them
+    first_byte = offset + (start-1) // line_bases * line_bytes + (start-1) % line_bases
+    last_byte = offset + (end-1) // line_bases * line_bytes + (end-1) % line_bases
+    with open(fasta_file, 'rb') as fh:
+        fh.seek(first_byte)
+        seq = fh.read(last_byte - first_byte + 1)
+    seq = seq.translate(None, b' \t\r\n').decode()
+    return seq if strand == 1 else _revcom(seq)
+
+def _sequence_for_pos_scan(fasta_file, chrom, strand, start, end):
+    """
+    Same as sequence_for_pos, but scans the FASTA file for the chromosome instead of using an index.
+    """
+    with open(fasta_file, 'rb') as fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        # scan the memory-mapped file for header lines instead of reading every sequence line, 
+        # header_start is the position of the next header line or -1 if there are no more
+        header_start = 0 if mm[:1] == b'>' else mm.find(b'\n>')
+        if header_start > 0 or mm[:2] == b'\n>':
+            header_start += 1
+        while header_start != -1:
+            header_end = mm.find(b'\n', header_start)
+            if header_end == -1:
+                header_end = len(mm)
+            next_header = mm.find(b'\n>', header_end)
+            seq_end = next_header if next_header != -1 else len(mm)
+            seq_id = _HEADER_RE.match(mm[header_start:header_end].decode())[1]
+            if seq_id.lower() == chrom.lower():
+                seq = mm[header_end:seq_end].translate(None, b' \t\r\n')
+                if len(seq) >= end:
+                    seq = seq[start-1:end].decode()
+                    return seq if strand == 1 else _revcom(seq)
+            header_start = next_header + 1 if next_header != -1 else -1
     raise ValueError('could not find chromosome or requested position in chromosome')   
                 
+def _load_or_build_fai(fasta_file):
+    """
+    fasta_file: path (str) to genome FASTA file
+    returns the FASTA index as dict of lowercase sequence ID -> (length, offset, line_bases, line_bytes), 
+    or None if the FASTA file can't be indexed (lines of a sequence differ in length).
+    An existing index file (fasta_file + '.fai', e.g. from samtools faidx) is used if it is 
+    not older than the FASTA file, otherwise the index is built and saved there if possible.
+    Indexes are also kept in memory, so repeated calls for the same file don't read it again.
+    """
+    fasta_stat = os.stat(fasta_file)
+    key = (fasta_stat.st_mtime_ns, fasta_stat.st_size)
+    cached = _FAI_CACHE.get(fasta_file)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+
+    fai_file = f'{fasta_file}.fai'
+    if os.path.exists(fai_file) and os.stat(fai_file).st_mtime_ns >= fasta_stat.st_mtime_ns:
+        entries = _read_fai(fai_file)
+    else:
+        entries = _build_fai(fasta_file)
+        if entries is not None:
+            try:
+                with _atomic_write(fai_file) as tmp_file, open(tmp_file, 'w') as fh:
+                    for entry in entries:
+                        fh.write("\t".join(str(value) for value in entry) + "\n")
+            except OSError:
+                pass # e.g. read-only genome directory, the index is still used in memory
+
+    fai = None
+    if entries is not None:
+        fai = {}
+        for name, length, offset, line_bases, line_bytes in entries:
+            fai.setdefault(name.lower(), (length, offset, line_bases, line_bytes))
+    _FAI_CACHE[fasta_file] = (key, fai)
+    return fai
+
+def _read_fai(fai_file):
+    """
+    fai_file: path (str) to FASTA index file
+    returns list of (name, length, offset, line_bases, line_bytes) entries
+    """
+    entries = []
+    with open(fai_file) as fh:
+        for line in fh:
+            cols = line.rstrip("\n").split("\t")
+            if len(cols) >= 5:
+                entries.append((cols[0], *(int(c) for c in cols[1:5])))
+    return entries
+
+def _build_fai(fasta_file):
+    """
+    fasta_file: path (str) to genome FASTA file
+    returns list of (name, length, offset, line_bases, line_bytes) entries in samtools faidx format, 
+    or None if the lines of a sequence (except the last) don't all have the same length
+    """
+    entries = []
+    entry = None
+    offset = 0
+    with open(fasta_file, 'rb') as fh:
+        for line in fh:
+            if line.startswith(b'>'):
+                # name, length, offset, line_bases, line_bytes
+                entry = [_HEADER_RE.match(line.decode())[1], 0, offset + len(line), 0, 0]
+                entries.append(entry)
+                last_line = False
+            elif entry is not None:
+                bases = len(line.strip())
+                if bases:
+                    if last_line or (entry[3] and bases > entry[3]):
+                        return None
+                    if not entry[3]:
+                        entry[3], entry[4] = bases, len(line)
+                    elif bases < entry[3] or len(line) != entry[4]:
+                        # only the last line of a sequence may be shorter (or lack the line break)
+                        last_line = True
+                    entry[1] += bases
+                else:
+                    last_line = True
+            offset += len(line)
+    return [tuple(entry) for entry in entries if entry[3]]
+                
+@contextmanager
+def _atomic_write(path):
+    """
+    path: path (str) of the file to write
+    yields a temporary path (str) next to path to write the file to, which is renamed to path 
+    when the block completes. An interrupted run therefore never leaves behind an incomplete 
+    index or cache file that later runs would trust. The temporary file is removed on errors.
+    """
+    tmp_file = f'{path}.{os.getpid()}.tmp'
+    try:
+        yield tmp_file
+        os.replace(tmp_file, path)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
 def _revcom(seq):
     """
     seq: sequence string
     returns: reverse complement of sequence (uppercased)
     """
-    complement = {'A': 'T', 'C': 'G', 'G': 'C', 'T': 'A'}
-    return "".join(complement.get(base, base) for base in reversed(seq.upper()))
+    return seq.upper().translate(_RC_TABLE)[::-1]
 
 if __name__ == "__main__":
     if len(sys.argv) < 4:
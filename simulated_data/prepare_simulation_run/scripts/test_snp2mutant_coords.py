@@ -0,0 +1,136 @@
+import pytest
+import os
+import snp2mutant_coords
+from snp2mutant_coords import find_cds_for_gene, sequence_for_pos, _sequence_for_pos_scan, _load_or_build_fai, _build_fai, _read_fai, _revcom
+
+SEQUENCES = {'chr1': 'ACGTACGTACGGGTTTAAACTTA', 'chr2': 'CCCCCGGGGGAT'}
+
+# the same sequences, wrapped at 10 bases per line in different ways
+WRAPPED_FASTA = '>chr1 first chromosome\nACGTACGTAC\nGGGTTTAAAC\nTTA\n>chr2\nCCCCCGGGGG\nAT\n'
+FASTA_VARIANTS = {
+    'wrapped': WRAPPED_FASTA,
+    'crlf': WRAPPED_FASTA.replace('\n', '\r\n'),
+    'no_trailing_newline': WRAPPED_FASTA.rstrip('\n'),
+    'blank_line_after_sequence': WRAPPED_FASTA.replace('TTA\n', 'TTA\n\n'),
+}
+
+def _write_fasta(tmp_path, text, name='genome.fasta'):
+    fasta_file = tmp_path / name
+    # binary, so that line endings are written as they are
+    fasta_file.write_bytes(text.encode())
+    return str(fasta_file)
+
+def test__build_fai(tmp_path):
+    fasta_file = _write_fasta(tmp_path, WRAPPED_FASTA)
+    entries = _build_fai(fasta_file)
+    # same as samtools faidx: name, length, offset of the first base, bases per line, bytes per line
+    assert entries == [('chr1', 23, 23, 10, 11), ('chr2', 12, 55, 10, 11)], 'index matches samtools faidx'
+
+    _load_or_build_fai(fasta_file)
+    assert _read_fai(fasta_file + '.fai') == entries, 'index is saved next to the FASTA file'
+    assert not [name for name in os.listdir(tmp_path) if name.endswith('.tmp')], 'no temporary files are left behind'
+
+@pytest.mark.parametrize('variant', FASTA_VARIANTS)
+def test_sequence_for_pos(tmp_path, variant):
+    fasta_file = _write_fasta(tmp_path, FASTA_VARIANTS[variant])
+    assert _load_or_build_fai(fasta_file) is not None, 'FASTA file can be indexed'
+    for chrom, seq in SEQUENCES.items():
+        for start in range(1, len(seq) + 1):
+            for end in range(start, min(start + 12, len(seq) + 1)):
+                expected = seq[start-1:end]
+                assert sequence_for_pos(fasta_file, chrom, 1, start, end) == expected, f'{chrom}:{start}-{end}'
+                assert sequence_for_pos(fasta_file, chrom.upper(), -1, start, end) == _revcom(expected), f'{chrom}:{start}-{end} (-)'
+                assert _sequence_for_pos_scan(fasta_file, chrom, 1, start, end) == expected, f'{chrom}:{start}-{end} (scan)'
+
+def test_sequence_for_pos_ragged(tmp_path):
+    """
+    A FASTA file with lines of different length can't be indexed, the file is scanned instead.
+    """
+    fasta_file = _write_fasta(tmp_path, '>chr1\nACGTACG\nTACGGGTTTAAAC\nTTA\n>chr2\nCCCCCGGGGG\nAT\n')
+    assert _load_or_build_fai(fasta_file) is None, 'no index for irregular line lengths'
+    assert not os.path.exists(fasta_file + '.fai'), 'no index file is written'
+    for chrom, seq in SEQUENCES.items():
+        for start in range(1, len(seq) + 1):
+            assert sequence_for_pos(fasta_file, chrom, 1, start, len(seq)) == seq[start-1:], f'{chrom}:{start}-{len(seq)}'
+
+def test_sequence_for_pos_invalid(tmp_path):
+    fasta_file = _write_fasta(tmp_path, WRAPPED_FASTA)
+    with pytest.raises(ValueError):
+        sequence_for_pos(fasta_file, 'chr3', 1, 1, 2)
+    with pytest.raises(ValueError):
+        sequence_for_pos(fasta_file, 'chr2', 1, 10, 13)
+    with pytest.raises(ValueError):
+        _sequence_for_pos_scan(fasta_file, 'chr2', 1, 10, 13)
+
+def test_sequence_for_pos_changed_fasta(tmp_path):
+    """
+    The index is built again if the FASTA file is newer than its index file.
+    """
+    fasta_file = _write_fasta(tmp_path, WRAPPED_FASTA)
+    assert sequence_for_pos(fasta_file, 'chr2', 1, 9, 12) == 'GGAT'
+
+    _write_fasta(tmp_path, '>chr2\nAT\n>chr1\nACGTACGTACGGGTTTAAACTTA\n')
+    fai_mtime_ns = os.stat(fasta_file + '.fai').st_mtime_ns
+    os.utime(fasta_file, ns=(fai_mtime_ns + 10**9, fai_mtime_ns + 10**9))
+    assert sequence_for_pos(fasta_file, 'chr1', 1, 9, 23) == 'ACGGGTTTAAACTTA', 'sequence is read with the new index'
+    assert _read_fai(fasta_file + '.fai')[0][:2] == ('chr2', 2), 'index file is updated'
+    assert snp2mutant_coords._FAI_CACHE[fasta_file][1]['chr2'][0] == 2, 'index in memory is updated'
+
+GFF_LINES = [
+    '##gff-version 3',
+    'chr1\tsrc\tgene\t100\t400\t.\t-\t.\tID=PF3D7_0001;Name=GENE1',
+    'chr1\tsrc\tmRNA\t100\t400\t.\t-\t.\tID=PF3D7_0001.1;Parent=PF3D7_0001',
+    'chr1\tsrc\tCDS\t100\t200\t.\t-\t0\tID=cds1;Parent=PF3D7_0001.1',
+    'chr1\tsrc\tCDS\t300\t400\t.\t-\t0\tID=cds2;Parent=PF3D7_0001.1',
+]
+
+@pytest.fixture
+def gff_file(tmp_path, monkeypatch):
+    """
+    A small GFF file, with an empty in-memory GFF cache so that every test starts from the cache file
+    """
+    monkeypatch.setattr(snp2mutant_coords, '_GFF_CACHE', {})
+    gff_path = tmp_path / 'genes.gff'
+    gff_path.write_text('\n'.join(GFF_LINES) + '\n')
+    return str(gff_path)
+
+def _parse_gff_unused(gff_path):
+    raise AssertionError('GFF file is parsed again')
+
+def test_find_cds_for_gene(gff_file):
+    chrom, strand, exons, matching_attrs = find_cds_for_gene(gff_file, 'PF3D7_0001')
+    assert (chrom, strand) == ('chr1', -1)
+    assert exons == [(300, 400), (100, 200)], 'CDS of the transcript in transcript order'
+    assert 'ID=PF3D7_0001.1' in matching_attrs, 'matching attributes are reported'
+    assert find_cds_for_gene(gff_file, 'PF3D7_9999')[:3] == (None, None, None), 'unknown gene'
+
+def test_find_cds_for_gene_cache(gff_file, monkeypatch):
+    expected = find_cds_for_gene(gff_file, 'PF3D7_0001')
+    assert os.path.exists(gff_file + '.cdscache.pickle'), 'cache file is written next to the GFF file'
+
+    monkeypatch.setattr(snp2mutant_coords, '_GFF_CACHE', {})
+    monkeypatch.setattr(snp2mutant_coords, '_parse_gff', _parse_gff_unused)
+    assert find_cds_for_gene(gff_file, 'PF3D7_0001') == expected, 'parsed GFF is loaded from the cache file'
+
+def test_find_cds_for_gene_cache_changed_gff(gff_file, monkeypatch):
+    find_cds_for_gene(gff_file, 'PF3D7_0001')
+    with open(gff_file, 'a') as fh:
+        fh.write('chr1\tsrc\tCDS\t500\t600\t.\t-\t0\tID=cds3;Parent=PF3D7_0001.1\n')
+    gff_stat = os.stat(gff_file)
+    os.utime(gff_file, ns=(gff_stat.st_atime_ns, gff_stat.st_mtime_ns + 10**9))
+
+    assert find_cds_for_gene(gff_file, 'PF3D7_0001')[2] == [(500, 600), (300, 400), (100, 200)], 'changed GFF is parsed again'
+    monkeypatch.setattr(snp2mutant_coords, '_GFF_CACHE', {})
+    monkeypatch.setattr(snp2mutant_coords, '_parse_gff', _parse_gff_unused)
+    assert find_cds_for_gene(gff_file, 'PF3D7_0001')[2] == [(500, 600), (300, 400), (100, 200)], 'cache file is updated'
+
+def test_find_cds_for_gene_cache_version(gff_file, monkeypatch):
+    find_cds_for_gene(gff_file, 'PF3D7_0001')
+    monkeypatch.setattr(snp2mutant_coords, '_GFF_CACHE', {})
+    monkeypatch.setattr(snp2mutant_coords, '_GFF_CACHE_VERSION', snp2mutant_coords._GFF_CACHE_VERSION + 1)
+    parsed = []
+    parse_gff = snp2mutant_coords._parse_gff
+    monkeypatch.setattr(snp2mutant_coords, '_parse_gff', lambda gff_path: parsed.append(gff_path) or parse_gff(gff_path))
+    assert find_cds_for_gene(gff_file, 'PF3D7_0001')[2] == [(300, 400), (100, 200)]
+    assert parsed == [gff_file], 'a cache file of another format version is not used'
+